@@ -0,0 +1,42 @@
+import time
+from services.sherpa_service import SherpaTTSService
+
+# =========================================================================
+# 📏 短句打包的实时率对比：逐句 generate vs 打包后 generate
+# =========================================================================
+# 用法: python bench_tts_packing.py
+# 实时率 (RTF) = 合成耗时 / 音频时长，越小越好。
+
+TRANSCRIPTS = [
+    "好的。嗯。没问题！我明白了。还有吗？",
+    "早上好！今天怎么样？睡得好吗？吃早饭了吗？",
+    "是的。对。没错。就是这样！你说得对。",
+    "哈哈！真有趣。再来一个？好呀！",
+    "稍等。我想想。嗯……有了！试试这个？",
+]
+
+def run(tts, transcripts, pack):
+    synth_sec = 0.0; audio_sec = 0.0; calls = 0
+    for text in transcripts:
+        segments = tts._split_text(text) or [text]
+        groups = tts.packer.pack(segments) if pack else [[s] for s in segments]
+        for group in groups:
+            t0 = time.perf_counter()
+            audio = tts.tts.generate("".join(group))
+            synth_sec += time.perf_counter() - t0
+            audio_sec += len(audio.samples) / tts.tts.sample_rate
+            calls += 1
+    return synth_sec / audio_sec, calls
+
+def main():
+    tts = SherpaTTSService()
+    tts.tts.generate("预热。")  # 第一次调用包含初始化开销，不计入
+    rtf_single, calls_single = run(tts, TRANSCRIPTS, pack=False)
+    rtf_packed, calls_packed = run(tts, TRANSCRIPTS, pack=True)
+    print(f"逐句合成: RTF={rtf_single:.3f}  generate 调用 {calls_single} 次")
+    print(f"打包合成: RTF={rtf_packed:.3f}  generate 调用 {calls_packed} 次")
+    if rtf_packed > 0:
+        print(f"提升: {rtf_single / rtf_packed:.2f}x")
+
+if __name__ == "__main__":
+    main()
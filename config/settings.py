@@ -14,5 +14,11 @@ SYSTEM_PROMPT = """
 回答请尽量简练。
 """
 
+# 内存预算 (MB)：主进程 + 推理子进程的 RSS 总和，超出后才在空闲时回收/收缩缓存
+# None 表示不设上限 (仍会按 GC 计数在空闲时回收)
+MEMORY_BUDGET_MB = None
+# 打开 tracemalloc，报告 Python 堆的当前/峰值和分配最多的代码行 (有额外开销，排查问题时再开)
+MEMORY_TRACE = False
+
 # 调试模式 (True 会打印更多信息)
 DEBUG = True
\ No newline at end of file
@@ -1,4 +1,5 @@
 import traceback
+import threading
 
 # 1. 尝试导入工具模块 (控制电脑)
 try:
@@ -9,9 +10,16 @@ except ImportError:
 
 # 2. 导入记忆模块 (长期记忆)
 from core.memory import MemoryManager
+from core.model_router import ModelRouter
 
 class CAIBrain:
-    def __init__(self, llm_service):
+    def __init__(self, llm_service, small_llm_service=None):
+        # 🟢 给了小模型就启用级联路由：闲聊走小模型，难题走 llm_service
+        # small_llm_service 可以是无参工厂函数，第一次用到时才加载
+        self.router = None
+        if small_llm_service is not None:
+            self.router = ModelRouter(small_llm_service, llm_service)
+            llm_service = self.router
         self.llm = llm_service
         
         # 🟢 初始化记忆管理器
@@ -33,12 +41,66 @@ class CAIBrain:
         )
         # =========================================================
 
+        # 🟢 投机预填充：只保留最新的一条半句话，后台线程串行处理
+        self._spec_lock = threading.Lock()
+        self._spec_pending = None
+        self._spec_running = False
+        self._spec_gen = 0  # 每提交一轮最终文本就 +1，之前排队的预填充作废
+
+    def memory_footprint(self):
+        """给 MemoryGovernor 的指标探针"""
+        return {"history_items": len(self.history),
+                "history_bytes": sum(len(m['content'].encode('utf-8')) for m in self.history)}
+
+    def shrink_history(self):
+        """内存紧张时只保留和硬盘记忆一样多的对话"""
+        self.history = self.history[-self.memory_mgr.max_history:]
+
+    def get_routing_stats(self):
+        return self.router.get_routing_stats() if self.router else {}
+
     def clear_memory(self):
         """清空记忆"""
         self.history = []
         self.memory_mgr.clear_memory() # 同时删除硬盘文件
 
+    def speculate(self, partial_text):
+        """
+        ASR 的中间结果稳定时调用 (不阻塞)。
+        让模型提前算好 system + 历史 + 半句话，最终结果出来后只需算剩下的后缀。
+        """
+        if not hasattr(self.llm, "prefill") or not partial_text.strip(): return
+        with self._spec_lock:
+            self._spec_pending = partial_text
+            if self._spec_running: return
+            self._spec_running = True
+        threading.Thread(target=self._speculate_loop, daemon=True).start()
+
+    def _speculate_loop(self):
+        while True:
+            with self._spec_lock:
+                text = self._spec_pending
+                self._spec_pending = None
+                if text is None:
+                    self._spec_running = False; return
+                # 半句话和历史在同一把锁里取：不会拿到已经追加了最终文本的历史
+                gen = self._spec_gen
+                history = list(self.history)
+            messages = [{"role": "system", "content": self.system_prompt}] + history
+            messages = messages + [{"role": "user", "content": text}]
+            with self._spec_lock:
+                if gen != self._spec_gen: continue  # 最终文本已经提交，这次预填充没用了
+            try:
+                self.llm.prefill(messages)
+            except Exception as e:
+                print(f"[Brain] 预填充失败: {e}")
+
     def chat_stream(self, user_text):
+        # 最终文本来了：还没执行的预填充全部作废，避免和正式请求抢锁
+        with self._spec_lock:
+            self._spec_pending = None
+            self._spec_gen += 1
+
         # --- 1. 工具拦截区 (打开软件/报时) ---
         if HAS_TOOLS:
             try:
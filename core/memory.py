@@ -1,14 +1,19 @@
 import json
 import os
+import threading
 
 class MemoryManager:
-    def __init__(self, filepath="data/memory.json", max_history=20):
+    def __init__(self, filepath="data/memory.json", max_history=20, transcript_path=None):
         """
         :param filepath: 记忆文件存储路径
         :param max_history: 也就是“记忆容量”。为了防止把模型撑爆，我们只保留最近的 N 轮对话。
+        :param transcript_path: 完整聊天记录 (JSONL，只追加)，给界面分页回看用，不喂给模型
         """
         self.filepath = filepath
         self.max_history = max_history
+        self.transcript_path = transcript_path or os.path.join(os.path.dirname(filepath), "transcript.jsonl")
+        self._offsets = None  # 聊天记录每一行的字节偏移，第一次用到时再建索引
+        self._transcript_lock = threading.Lock()
         self.ensure_directory()
 
     def ensure_directory(self):
@@ -48,4 +53,54 @@ class MemoryManager:
     def clear_memory(self):
         """彻底遗忘"""
         if os.path.exists(self.filepath):
-            os.remove(self.filepath)
\ No newline at end of file
+            os.remove(self.filepath)
+        with self._transcript_lock:
+            if os.path.exists(self.transcript_path):
+                os.remove(self.transcript_path)
+            self._offsets = []
+
+    # ---------------- 完整聊天记录 (分页读取) ----------------
+    def _index_transcript(self):
+        """扫描一遍文件，记下每行开头的位置，之后读任意一页都只需 seek"""
+        if self._offsets is not None: return
+        self._offsets = []
+        if not os.path.exists(self.transcript_path): return
+        with open(self.transcript_path, 'rb') as f:
+            pos = 0
+            for line in f:
+                self._offsets.append(pos)
+                pos += len(line)
+
+    def append_transcript(self, role, content):
+        """追加一条聊天记录，返回它的序号"""
+        with self._transcript_lock:
+            self._index_transcript()
+            line = json.dumps({"role": role, "content": content}, ensure_ascii=False) + "\n"
+            try:
+                with open(self.transcript_path, 'ab') as f:
+                    self._offsets.append(f.tell())
+                    f.write(line.encode('utf-8'))
+            except Exception as e:
+                print(f"[Memory Error] 记录失败: {e}")
+                return None
+            return len(self._offsets) - 1
+
+    def transcript_length(self):
+        with self._transcript_lock:
+            self._index_transcript()
+            return len(self._offsets)
+
+    def load_transcript(self, start, count):
+        """读取第 start 条开始的 count 条聊天记录"""
+        with self._transcript_lock:
+            self._index_transcript()
+            start = max(0, start)
+            end = min(len(self._offsets), start + count)
+            if start >= end: return []
+            try:
+                with open(self.transcript_path, 'rb') as f:
+                    f.seek(self._offsets[start])
+                    return [json.loads(f.readline()) for _ in range(end - start)]
+            except Exception as e:
+                print(f"[Memory Error] 读取记录失败: {e}")
+                return []
\ No newline at end of file
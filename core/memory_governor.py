@@ -0,0 +1,193 @@
+import os
+import gc
+import time
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+# psutil 是可选依赖：没有时退回 /proc (Linux)，再不行就只报告各组件自己的指标
+try:
+    import psutil
+    HAS_PSUTIL = True
+except ImportError:
+    HAS_PSUTIL = False
+
+def process_rss(pid=None):
+    """进程常驻内存 (字节)，拿不到时返回 None"""
+    pid = pid or os.getpid()
+    try:
+        if HAS_PSUTIL: return psutil.Process(pid).memory_info().rss
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        return None
+
+class MemoryGovernor:
+    GC_FORCE_FACTOR = 5          # 完整 GC 欠账到预算的这个倍数就不再等空闲
+    GC_GEN2_DISABLED = 1 << 30   # 第 3 个阈值设这么大，解释器就不会自己触发完整 GC
+
+    """
+    内存管家：替代每次请求前的 gc.collect()。
+    - 各组件注册自己的指标探针 (RSS / 队列长度 / 条数) 和收缩回调
+    - 运行期间接管第 2 代 (完整) GC：解释器不再自动做，只有超出预算、并且系统空闲时才做
+    - 超出预算较多 (内存压力) 时依次调用收缩回调释放缓存
+    """
+    def __init__(self, rss_budget_mb=None, gc_full_budget=10, pressure_ratio=1.2,
+                 interval=5.0, idle_after=2.0, trace=False):
+        """
+        :param rss_budget_mb: 所有被监控进程 RSS 之和的预算，None 表示不限制
+        :param gc_full_budget: 距上次完整 GC 以来的中生代回收次数，超过它才值得做一次完整 GC；
+                               一直忙、推迟到 GC_FORCE_FACTOR 倍时不再等空闲
+        :param pressure_ratio: RSS 超过预算的这个倍数时触发收缩回调
+        :param interval: 后台检查间隔 (秒)
+        :param idle_after: 最后一次忙碌结束后多久算空闲 (秒)
+        :param trace: 打开 tracemalloc，报告 Python 堆的当前/峰值
+        """
+        self.rss_budget = rss_budget_mb * 1024 * 1024 if rss_budget_mb else None
+        self.gc_full_budget = gc_full_budget
+        self.pressure_ratio = pressure_ratio
+        self.interval = interval
+        self.idle_after = idle_after
+        self.trace = trace
+
+        self.components = {}  # name -> {"probe", "shrink", "pid"}
+        self._lock = threading.Lock()
+        self._busy = 0
+        self._idle_since = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = None
+        self._saved_threshold = None  # start() 之前的 gc 阈值，stop() 时恢复
+        self.stats = {"checks": 0, "collections": 0, "collected": 0, "gc_pause_ms": 0.0,
+                      "shrinks": 0, "deferred": 0, "forced": 0}
+
+    # ---------------- 注册组件 ----------------
+    def register(self, name, probe=None, shrink=None, pid=None, busy=None):
+        """
+        :param probe: 无参函数，返回 {指标名: 数值}，例如队列长度
+        :param shrink: 内存压力时调用的无参函数，用来释放缓存
+        :param pid: 组件跑在子进程里时，把它的 RSS 也算进来 (可以传函数，进程重启后 pid 会变)
+        :param busy: 无参函数，返回 True 表示组件正在干活 (例如还有音频没播完)，这时不做 GC
+        """
+        self.components[name] = {"probe": probe, "shrink": shrink, "pid": pid, "busy": busy}
+
+    # ---------------- 忙碌 / 空闲 ----------------
+    def mark_busy(self):
+        with self._lock: self._busy += 1
+
+    def mark_idle(self):
+        with self._lock:
+            self._busy = max(0, self._busy - 1)
+            if self._busy == 0: self._idle_since = time.monotonic()
+
+    @contextmanager
+    def busy(self):
+        self.mark_busy()
+        try: yield
+        finally: self.mark_idle()
+
+    def _components_busy(self):
+        return any(comp["busy"] and comp["busy"]() for comp in self.components.values())
+
+    def is_busy(self):
+        """只读查询：有请求在跑或者某个组件报告忙碌 (不影响空闲计时，给指标展示用)"""
+        with self._lock:
+            if self._busy: return True
+        return self._components_busy()
+
+    def is_idle(self):
+        with self._lock:
+            if self._busy or time.monotonic() - self._idle_since < self.idle_after: return False
+        if self._components_busy():
+            # 组件自己报告忙碌，重新计算空闲时间
+            with self._lock: self._idle_since = time.monotonic()
+            return False
+        return True
+
+    # ---------------- 指标 ----------------
+    def _pid_of(self, comp):
+        pid = comp["pid"]
+        return pid() if callable(pid) else pid
+
+    def snapshot(self):
+        """当前内存画像：各进程 RSS、各组件指标、GC 计数、Python 堆"""
+        main_rss = process_rss()
+        snap = {"rss": {"main": main_rss}, "components": {}, "gc_count": gc.get_count(),
+                "busy": self.is_busy(), "governor": dict(self.stats)}
+        total = main_rss or 0
+        for name, comp in self.components.items():
+            pid = self._pid_of(comp)
+            if pid:
+                rss = process_rss(pid)
+                snap["rss"][name] = rss
+                total += rss or 0
+            if comp["probe"]:
+                try: snap["components"][name] = comp["probe"]()
+                except Exception as e: snap["components"][name] = {"error": str(e)}
+        snap["rss"]["total"] = total
+        if self.rss_budget: snap["rss"]["budget"] = self.rss_budget
+        if self.trace and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            snap["python_heap"] = {"current": current, "peak": peak}
+        return snap
+
+    def top_allocations(self, limit=10):
+        """tracemalloc 分配最多的代码行 (比较慢，只在排查问题时调用)"""
+        if not tracemalloc.is_tracing(): return []
+        stats = tracemalloc.take_snapshot().statistics("lineno")[:limit]
+        return [(str(s.traceback), s.size, s.count) for s in stats]
+
+    # ---------------- 回收策略 ----------------
+    def check(self):
+        """检查一次：超预算才回收，忙的时候推迟"""
+        self.stats["checks"] += 1
+        total_rss = self.snapshot()["rss"]["total"]
+        over_rss = self.rss_budget is not None and total_rss > self.rss_budget
+        # 自动完整 GC 已关闭，gc.get_count()[2] 就是上次完整 GC 以来的中生代回收次数
+        pending = gc.get_count()[2]
+        over_gc = pending >= self.gc_full_budget
+        if not (over_rss or over_gc): return
+
+        if not self.is_idle():
+            if pending < self.gc_full_budget * self.GC_FORCE_FACTOR:
+                self.stats["deferred"] += 1; return
+            self.stats["forced"] += 1  # 一直没空闲，垃圾不能无限堆下去
+
+        if over_rss and total_rss > self.rss_budget * self.pressure_ratio:
+            self._shrink()
+        self._collect()
+
+    def _collect(self):
+        t0 = time.perf_counter()
+        self.stats["collected"] += gc.collect()
+        self.stats["gc_pause_ms"] += (time.perf_counter() - t0) * 1000
+        self.stats["collections"] += 1
+
+    def _shrink(self):
+        for name, comp in self.components.items():
+            if not comp["shrink"]: continue
+            try: comp["shrink"]()
+            except Exception as e: print(f"[Memory] {name} 收缩失败: {e}")
+        self.stats["shrinks"] += 1
+
+    # ---------------- 后台线程 ----------------
+    def start(self):
+        if self.trace and not tracemalloc.is_tracing(): tracemalloc.start()
+        # 启动阶段留下的对象 (模型配置、模块等) 移出 GC 扫描范围，之后每次回收都更快
+        gc.collect(); gc.freeze()
+        # 🟢 接管完整 GC：保留第 0/1 代的自动回收，第 2 代只由 check() 在空闲时做
+        self._saved_threshold = gc.get_threshold()
+        gc.set_threshold(self._saved_threshold[0], self._saved_threshold[1], self.GC_GEN2_DISABLED)
+        self._thread = threading.Thread(target=self._run, name="MemoryGovernor", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try: self.check()
+            except Exception as e: print(f"[Memory] 检查失败: {e}")
+
+    def stop(self):
+        self._stop.set()
+        if self._saved_threshold is not None:
+            gc.set_threshold(*self._saved_threshold)
+            self._saved_threshold = None
@@ -0,0 +1,202 @@
+import re
+import time
+import threading
+
+# =========================================================================
+# 🔀 级联路由：闲聊走小模型，难题走大模型
+# =========================================================================
+
+# 语气词 / 口头禅：打分前去掉，不算闲聊也不抵消后面的真实意图 ("嗯，为什么…")
+FILLERS = ("嗯", "呃", "啊", "哦", "那个", "好的")
+# 明显是寒暄 / 闲聊的说法
+SMALL_TALK = ("你好", "您好", "早上好", "中午好", "晚上好", "晚安", "早安", "谢谢", "多谢", "哈哈",
+              "在吗", "再见", "拜拜", "辛苦", "hi", "hello", "hey", "thanks", "thank you", "bye",
+              "good morning", "good night", "how are you", "how's it going", "what's up", "whats up",
+              "nice to meet you")
+# 需要推理、知识或长输出的说法。英文只收多词 / 问句式的说法，单独的 "how" 太常见 ("how are you")
+HARD_INTENT = ("为什么", "怎么", "如何", "解释", "分析", "原理", "区别", "比较", "总结", "翻译",
+               "代码", "程序", "函数", "算法", "计算", "证明", "步骤", "方案", "写一", "帮我写",
+               "why", "how do", "how does", "how to", "how can", "how should", "how would",
+               "what is the difference", "explain", "write a", "write me", "code")
+# 追问：沿用上一轮的路由
+FOLLOW_UP = ("继续", "然后呢", "还有呢", "接着", "详细", "展开", "go on", "continue")
+
+def _keywords(words):
+    # 英文按单词边界匹配 ("hi" 不命中 "this"，"code" 不命中 "decode")；中文没有词边界，按子串匹配
+    parts = [rf"(?<![a-z]){re.escape(w)}(?![a-z])" if w.isascii() else re.escape(w) for w in words]
+    return re.compile("|".join(parts))
+
+_FILLER_RE = _keywords(FILLERS)
+_SMALL_TALK_RE = _keywords(SMALL_TALK)
+_HARD_INTENT_RE = _keywords(HARD_INTENT)
+_FOLLOW_UP_RE = _keywords(FOLLOW_UP)
+
+# 分类的预期结果，改关键词后跑 python -m core.model_router 自检
+_EXAMPLES = [
+    ("你好", "small"), ("好的", "small"), ("嗯嗯", "small"), ("hi", "small"), ("hi你好", "small"),
+    ("how are you", "small"), ("what's up", "small"), ("this is fine", "small"),
+    ("show me", "small"), ("decode it", "small"), ("which one", "small"),
+    ("嗯，为什么天空是蓝的", "large"), ("帮我写一段代码", "large"), ("how does it work", "large"),
+    ("hello, how do i write code", "large"), ("你好，为什么天空是蓝的", "large"), ("explain recursion", "large"),
+]
+
+class ModelRouter:
+    """
+    和 LocalLLMService 接口一致，可以直接交给 CAIBrain 当 llm 用。
+    small / large 可以是服务实例，也可以是无参工厂函数 (第一次用到时才加载)。
+    """
+    def __init__(self, small, large, escalate=True, threshold=0.45, probe_chunks=8):
+        self._sources = {"small": small, "large": large}
+        self._services = {}
+        self._unavailable = set()
+        self._load_lock = threading.Lock()
+        self.escalate = escalate
+        self.threshold = threshold        # 小模型开头几个 token 的平均置信度低于它就升级
+        self.probe_chunks = probe_chunks  # 用开头多少个 chunk 判断置信度
+        self.last_route = "small"
+
+        self.stats = {
+            "small": 0, "large": 0, "escalated": 0, "small_unavailable": 0,
+            # [轮数, 总首 token 耗时]；escalated 从请求开始算到大模型吐出第一个 token
+            "latency": {"small": [0, 0.0], "large": [0, 0.0], "escalated": [0, 0.0]},
+        }
+
+        self.client = self
+        self.chat = self
+        self.completions = self
+
+    def get_model_id(self): return "Cascade-Router"
+
+    # ---------------- 懒加载 ----------------
+    def _get(self, name):
+        if name in self._services: return self._services[name]
+        if name in self._unavailable: return None
+        with self._load_lock:
+            if name not in self._services and name not in self._unavailable:
+                source = self._sources[name]
+                try:
+                    self._services[name] = source() if callable(source) and not hasattr(source, "create") else source
+                    print(f"[Router] {name} model ready.")
+                except Exception as e:
+                    print(f"[Router] {name} model unavailable: {e}")
+                    self._unavailable.add(name)
+        return self._services.get(name)
+
+    # ---------------- 分类 ----------------
+    def classify(self, messages):
+        """廉价特征打分：长度、意图关键词、上下文。返回 "small" 或 "large" """
+        user_text = next((m['content'] for m in reversed(messages) if m['role'] == 'user'), "")
+        text = _FILLER_RE.sub("", user_text.lower()).strip(" ，,。.!！~～")
+        if not text: return "small"
+
+        if _FOLLOW_UP_RE.search(text) and len(text) <= 12:
+            return self.last_route
+
+        score = 0
+        if len(text) > 40: score += 2
+        elif len(text) > 15: score += 1
+        hard = _HARD_INTENT_RE.search(text)
+        if hard: score += 2
+        if re.search(r"[{}()\[\]=<>]|\d+\s*[-+*/^]\s*\d+", text): score += 2  # 代码 / 算式
+        if text.count("？") + text.count("?") > 1: score += 1
+        # 寒暄只在没有真实意图时减分："hello, how do i …" 仍然是难题
+        if not hard and _SMALL_TALK_RE.search(text): score -= 2
+        # 上一条 AI 回复很长，说明话题本身较深
+        last_ai = next((m['content'] for m in reversed(messages) if m['role'] == 'assistant'), "")
+        if len(last_ai) > 300: score += 1
+        return "large" if score >= 2 else "small"
+
+    # ---------------- 推理接口 ----------------
+    def create(self, model, messages, temperature=0.7, max_tokens=600, timeout=None, stream=False):
+        return self._route(messages, dict(model=model, messages=messages, temperature=temperature,
+                                          max_tokens=max_tokens, timeout=timeout, stream=True))
+
+    def _route(self, messages, kwargs):
+        route = self.classify(messages)
+        small = self._get("small") if route == "small" else None
+        if route == "small" and small is None:
+            self.stats["small_unavailable"] += 1
+            route = "large"
+        self.last_route = route
+        t0 = time.perf_counter()
+
+        if route == "large":
+            self.stats["large"] += 1
+            yield from self._timed("large", self._get("large").create(**kwargs), t0); return
+
+        if not self.escalate:
+            self.stats["small"] += 1
+            yield from self._timed("small", small.create(**kwargs), t0); return
+
+        # 🟢 先缓冲小模型开头几个 chunk，置信度够才放出去，否则换大模型重来
+        gen = small.create(confidence=True, **kwargs)
+        buffered = []; scores = []
+        for chunk in gen:
+            buffered.append(chunk)
+            choices = chunk.get('choices') or []
+            if choices and 'confidence' in choices[0]: scores.append(choices[0]['confidence'])
+            if len(buffered) >= self.probe_chunks: break
+
+        if scores and sum(scores) / len(scores) < self.threshold:
+            gen.close()
+            self.stats["escalated"] += 1
+            self.last_route = "large"
+            print(f"[Router] 小模型置信度 {sum(scores) / len(scores):.2f}，升级到大模型")
+            yield from self._timed("escalated", self._get("large").create(**kwargs), t0)
+            return
+
+        self.stats["small"] += 1
+        self._record("small", t0)
+        yield from buffered
+        yield from gen
+
+    def _timed(self, route, gen, t0):
+        first = True
+        for chunk in gen:
+            if first: self._record(route, t0); first = False
+            yield chunk
+
+    def _record(self, route, t0):
+        # 记录首 token 延迟 (用户真正感受到的等待时间)
+        entry = self.stats["latency"][route]
+        entry[0] += 1; entry[1] += time.perf_counter() - t0
+
+    def prefill(self, messages):
+        # 只给会被选中、并且已经加载好的模型做预填充
+        service = self._services.get(self.classify(messages))
+        if service is not None and hasattr(service, "prefill"):
+            return service.prefill(messages)
+        return 0
+
+    def get_routing_stats(self):
+        """
+        路由比例，以及按平均首 token 延迟估算出的节省时间：
+        小模型答完的轮次各省 (大 - 小)，升级的轮次各多等 (升级 - 大)，两者相减
+        """
+        s = self.stats
+        total = s["small"] + s["large"] + s["escalated"]
+        def avg(route):
+            n, t = s["latency"][route]
+            return n, (t / n if n else 0.0)
+        (n_small, avg_small), (n_large, avg_large), (n_esc, avg_esc) = avg("small"), avg("large"), avg("escalated")
+        saved = 0.0
+        if n_large:
+            saved = n_small * (avg_large - avg_small) - n_esc * (avg_esc - avg_large)
+        return {
+            "turns": total,
+            "small_ratio": s["small"] / total if total else 0.0,
+            "small": s["small"], "large": s["large"],
+            "escalated": s["escalated"], "small_unavailable": s["small_unavailable"],
+            "avg_small_ttft": avg_small, "avg_large_ttft": avg_large, "avg_escalated_ttft": avg_esc,
+            "saved_sec": saved,
+        }
+
+def _self_check():
+    router = ModelRouter(None, None)
+    for text, expected in _EXAMPLES:
+        got = router.classify([{"role": "user", "content": text}])
+        assert got == expected, f"{text!r}: expected {expected}, got {got}"
+    print(f"[Router] {len(_EXAMPLES)} 条分类样例全部通过")
+
+if __name__ == "__main__":
+    _self_check()
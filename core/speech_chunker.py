@@ -0,0 +1,105 @@
+# 与 ui_module.StreamWorker 使用同一套断句标点
+SENTENCE_END = ("。", "！", "？", "\n", ".", "!", "?", "：")
+
+# 估算每句音频时长时不计入的字符
+_SILENT_CHARS = set("。！？；：，、,.!?;:\"'“”‘’（）() \n\t")
+
+THINK_START = "<think>"
+THINK_END = "</think>"
+
+class SentenceChunker:
+    """
+    把 LLM 的 token 流切成一句一句，直接喂给 TTS。
+    <think>...</think> 里的思考过程会被吞掉，不会被念出来。
+    """
+    def __init__(self):
+        self.buffer = ""       # 还没确定是不是标签的原始文本
+        self.sentence = ""     # 正在拼的句子
+        self.in_thinking = False
+
+    def feed(self, token):
+        """输入一个 token，返回这次凑齐的句子列表 (可能为空)"""
+        self.buffer += token
+        sentences = []
+        while self.buffer:
+            if self.in_thinking:
+                end = self.buffer.find(THINK_END)
+                if end < 0:
+                    # 只留下可能是半个结束标签的尾巴
+                    self.buffer = self.buffer[-len(THINK_END):]
+                    break
+                self.buffer = self.buffer[end + len(THINK_END):]
+                self.in_thinking = False
+                continue
+
+            start = self.buffer.find(THINK_START)
+            if start >= 0:
+                self._append(self.buffer[:start], sentences)
+                self.buffer = self.buffer[start + len(THINK_START):]
+                self.in_thinking = True
+                continue
+
+            # 结尾可能是被拆开的 "<thi"，先留着等下一个 token
+            lt = self.buffer.rfind("<")
+            if lt >= 0 and THINK_START.startswith(self.buffer[lt:]):
+                self._append(self.buffer[:lt], sentences)
+                self.buffer = self.buffer[lt:]
+            else:
+                self._append(self.buffer, sentences)
+                self.buffer = ""
+            break
+        return sentences
+
+    def flush(self):
+        """流结束时调用，返回剩下的半句"""
+        sentences = []
+        if not self.in_thinking: self._append(self.buffer, sentences)
+        self.buffer = ""
+        if self.sentence.strip(): sentences.append(self.sentence)
+        self.sentence = ""
+        return sentences
+
+    def _append(self, text, sentences):
+        for ch in text:
+            self.sentence += ch
+            if ch in SENTENCE_END:
+                if self.sentence.strip(): sentences.append(self.sentence)
+                self.sentence = ""
+
+class SegmentPacker:
+    """
+    把相邻的短句合并成一次 TTS generate，省掉每次调用模型的固定开销。
+    第一组只凑够 first_len 个字就发，保证首包延迟不变；之后每组最多 target_len 个字。
+    """
+    def __init__(self, target_len=40, first_len=6):
+        self.target_len = target_len
+        self.first_len = first_len
+
+    def pack(self, segments, first_alone=True):
+        """
+        返回分组后的列表，例如 [["你好。"], ["今天。", "不错！"]]
+        :param first_alone: 第一组凑够 first_len 个字就截断 (几句很短的话仍会合在一起)
+        """
+        groups = []; current = []; current_len = 0
+        for seg in segments:
+            n = len(seg.strip())
+            first_full = first_alone and not groups and current_len >= self.first_len
+            if current and (current_len + n > self.target_len or first_full):
+                groups.append(current); current = []; current_len = 0
+            current.append(seg); current_len += n
+        if current: groups.append(current)
+        return groups
+
+def split_by_weight(samples, segments):
+    """
+    合并合成后，按每句的发音字数比例把音频切回去 (估算边界)，
+    这样停止播放时仍然能停在原来的句子边界上。
+    """
+    if len(segments) == 1: return [samples]
+    weights = [max(1, sum(1 for ch in seg if ch not in _SILENT_CHARS)) for seg in segments]
+    total = sum(weights); pieces = []; start = 0; acc = 0
+    for w in weights:
+        acc += w
+        end = round(len(samples) * acc / total)
+        pieces.append(samples[start:end]); start = end
+    return pieces
@@ -0,0 +1,218 @@
+import json
+import struct
+import threading
+import multiprocessing as mp
+
+# =========================================================================
+# 🧵 独立推理进程：Llama 只存在于子进程里，主进程 (UI/TTS/音频回调) 不再和它抢 GIL
+# =========================================================================
+
+# 🟢 固定长度帧头：1 字节类型 + 4 字节负载长度 + 4 字节置信度 (小端，没有时为 NaN)，负载是 UTF-8 文本
+_HEADER = struct.Struct("<BIf")
+FRAME_READY, FRAME_TOKEN, FRAME_END, FRAME_ERROR = 1, 2, 3, 4
+_NO_SCORE = float("nan")
+
+def _pack(kind, text="", score=_NO_SCORE):
+    payload = text.encode("utf-8")
+    return _HEADER.pack(kind, len(payload), score) + payload
+
+def _unpack(buf):
+    kind, n, score = _HEADER.unpack_from(buf)
+    return kind, bytes(buf[_HEADER.size:_HEADER.size + n]).decode("utf-8"), score
+
+def _error_gen():
+    yield {"choices":[{"delta":{"content": " (Error) "}}]}
+
+def _worker_main(conn, cancel_event, service_kwargs):
+    """子进程入口：加载模型，然后循环处理请求，逐 token 回传"""
+    try:
+        # 只在子进程里导入，主进程永远不加载 llama_cpp
+        from services.local_llm_service import LocalLLMService
+        service = LocalLLMService(**service_kwargs)
+    except Exception as e:
+        conn.send_bytes(_pack(FRAME_ERROR, str(e))); conn.close(); return
+    conn.send_bytes(_pack(FRAME_READY))
+
+    while True:
+        try: request = conn.recv()
+        except (EOFError, OSError): break
+        if request is None: break
+        try:
+            if request["op"] != "create":
+                # 非流式调用 (prefill / 统计)：结果以 JSON 放在 END 帧里
+                result = getattr(service, request["op"])(**request.get("kwargs", {}))
+                conn.send_bytes(_pack(FRAME_END, json.dumps(result))); continue
+            for chunk in service.create(**request["kwargs"]):
+                if cancel_event.is_set(): break
+                choices = chunk.get('choices') or []
+                if choices:
+                    token = choices[0].get('delta', {}).get('content')
+                    score = choices[0].get('confidence', _NO_SCORE)
+                    if token: conn.send_bytes(_pack(FRAME_TOKEN, token, score))
+            conn.send_bytes(_pack(FRAME_END))
+        except Exception as e:
+            try: conn.send_bytes(_pack(FRAME_ERROR, str(e)))
+            except (EOFError, OSError): break
+
+class LLMProcessService:
+    """
+    和 LocalLLMService 接口一致 (create / get_model_id / client.chat.completions)，
+    但模型跑在独立进程里。子进程崩溃时自动重启，主进程不受影响。
+    """
+    def __init__(self, max_restarts=3, **service_kwargs):
+        self.service_kwargs = service_kwargs
+        self.max_restarts = max_restarts
+        self.restart_count = 0  # 连续崩溃次数，任何一次请求成功就清零
+        self.process = None
+        self.conn = None
+        self._ctx = mp.get_context("spawn")  # 与 Windows/PyInstaller 行为保持一致
+        self._lock = threading.Lock()        # 一个 Llama 同一时间只服务一个请求
+
+        self._start_worker()
+
+        self.client = self
+        self.chat = self
+        self.completions = self
+
+    def get_model_id(self): return "Embedded-Stream (Worker)"
+
+    # ---------------- 进程管理 ----------------
+    def _start_worker(self):
+        parent_conn, child_conn = self._ctx.Pipe(duplex=True)
+        self.cancel_event = self._ctx.Event()
+        self.process = self._ctx.Process(
+            target=_worker_main, args=(child_conn, self.cancel_event, self.service_kwargs),
+            name="CAI-LLM-Worker", daemon=True
+        )
+        self.process.start()
+        child_conn.close()  # 父进程不持有子端，子进程退出时这边才能收到 EOF
+        self.conn = parent_conn
+
+        # 阻塞等待模型加载完成 (和原来在构造函数里加载的行为一致)
+        try:
+            kind, text, _ = self._recv()
+        except EOFError:
+            kind, text = FRAME_ERROR, "worker exited during load"
+        if kind != FRAME_READY:
+            self._kill_worker()
+            raise RuntimeError(f"LLM worker failed to start: {text}")
+        print(f"[Core] LLM worker ready (pid={self.process.pid}).")
+
+    def _kill_worker(self):
+        if self.conn is not None:
+            try: self.conn.close()
+            except: pass
+            self.conn = None
+        if self.process is not None:
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process.join(timeout=2)
+            self.process = None
+
+    def _ensure_worker(self):
+        if self.process is not None and self.process.is_alive(): return
+        if self.restart_count >= self.max_restarts:
+            raise RuntimeError("LLM worker crashed too many times")
+        self.restart_count += 1
+        print(f"[Core] Restarting LLM worker ({self.restart_count}/{self.max_restarts})...")
+        self._kill_worker()
+        self._start_worker()
+
+    def _restart_async(self):
+        # 崩溃后立刻在后台拉起新进程，下一轮对话就不用再等模型加载
+        with self._lock:
+            try: self._ensure_worker()
+            except Exception as e: print(f"[Core] Restart Failed: {e}")
+
+    def _recv(self):
+        # 子进程挂掉时管道被关闭，poll 返回 True 且 recv_bytes 抛 EOFError
+        while not self.conn.poll(0.5):
+            if not self.process.is_alive(): raise EOFError("LLM worker exited")
+        return _unpack(self.conn.recv_bytes())
+
+    def _cancel(self):
+        """消费者中途放弃生成器：通知子进程停下，并把剩余的帧读干净"""
+        try:
+            self.cancel_event.set()
+            while True:
+                kind, _, _ = self._recv()
+                if kind in (FRAME_END, FRAME_ERROR): break
+        except (EOFError, OSError):
+            self._kill_worker()
+        finally:
+            if self.process is not None: self.cancel_event.clear()
+
+    # ---------------- 推理接口 ----------------
+    def create(self, model, messages, temperature=0.7, max_tokens=600, timeout=None, stream=False, confidence=False):
+        request = {"op": "create", "kwargs": dict(
+            model=model, messages=messages, temperature=temperature, max_tokens=max_tokens, confidence=confidence
+        )}
+        return self._stream(request)
+
+    def _call(self, op, blocking=True, **kwargs):
+        """非流式调用子进程里 LocalLLMService 的方法；blocking=False 时正在生成就直接放弃"""
+        if not self._lock.acquire(blocking=blocking): return None
+        try:
+            self._ensure_worker()
+            self.conn.send({"op": op, "kwargs": kwargs})
+            kind, text, _ = self._recv()
+            if kind == FRAME_ERROR:
+                print(f"[LLM Error] {text}"); return None
+            self.restart_count = 0
+            return json.loads(text) if text else None
+        except (EOFError, OSError, RuntimeError) as e:
+            print(f"[LLM Error] Worker crashed: {e}")
+            self._kill_worker()
+            threading.Thread(target=self._restart_async, daemon=True).start()
+            return None
+        finally:
+            self._lock.release()
+
+    def prefill(self, messages):
+        # 正在生成回复时跳过：预填充只是锦上添花，不能阻塞 ASR
+        return self._call("prefill", blocking=False, messages=messages) or 0
+
+    def get_prefill_stats(self):
+        return self._call("get_prefill_stats") or {}
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process is not None and self.process.is_alive() else None
+
+    def _stream(self, request):
+        with self._lock:
+            finished = False
+            try:
+                self._ensure_worker()
+                self.conn.send(request)
+                while True:
+                    kind, text, score = self._recv()
+                    if kind == FRAME_TOKEN:
+                        choice = {"delta":{"content": text}}
+                        if score == score: choice["confidence"] = score  # NaN 表示没有置信度
+                        yield {"choices":[choice]}
+                        continue
+                    finished = True
+                    if kind == FRAME_ERROR:
+                        print(f"[LLM Error] {text}")
+                        yield from _error_gen()
+                    else:
+                        self.restart_count = 0  # 成功完成一次请求，之前的崩溃不再累计
+                    break
+            except (EOFError, OSError, RuntimeError) as e:
+                finished = True
+                print(f"[LLM Error] Worker crashed: {e}")
+                self._kill_worker()
+                threading.Thread(target=self._restart_async, daemon=True).start()
+                yield from _error_gen()
+            finally:
+                if not finished and self.conn is not None: self._cancel()
+
+    def close(self):
+        with self._lock:
+            if self.conn is not None:
+                try: self.conn.send(None)
+                except: pass
+            if self.process is not None:
+                self.process.join(timeout=2)
+            self._kill_worker()
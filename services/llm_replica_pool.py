@@ -0,0 +1,138 @@
+import os
+import time
+import argparse
+import threading
+import multiprocessing
+from collections import deque
+
+from services.llm_process_service import LLMProcessService
+
+# =========================================================================
+# 🧬 多副本推理池：N 个推理进程打开同一个 GGUF (mmap，权重在页缓存里只有一份)，
+#    每个进程有自己的 KV 上下文 (CTX_LIMIT)，请求派给最闲的那个
+# =========================================================================
+
+class LLMReplicaPool:
+    """
+    接口和 LocalLLMService / LLMProcessService 一致，可以直接交给 CAIBrain。
+    """
+    def __init__(self, replicas=None, threads_per_replica=None, rate_window=10.0, **service_kwargs):
+        """
+        :param replicas: 副本数，默认按 CPU 核数每 4 核一个
+        :param threads_per_replica: 每个副本的推理线程数，默认把核数均分
+        :param rate_window: 统计 tok/s 的滑动窗口 (秒)
+        :param service_kwargs: 透传给 LocalLLMService (model_file 等)
+        """
+        cores = os.cpu_count() or 1
+        self.replicas = replicas or max(1, cores // 4)
+        threads = threads_per_replica or max(1, cores // self.replicas)
+        print(f"[Pool] Starting {self.replicas} replicas x {threads} threads ({cores} cores)...")
+
+        # 🟢 并行拉起所有副本：第一个把 GGUF 读进页缓存，其余直接映射同一份
+        self.workers = [None] * self.replicas
+        errors = []
+        def boot(i):
+            try: self.workers[i] = LLMProcessService(n_threads=threads, **service_kwargs)
+            except Exception as e: errors.append(e)
+        booters = [threading.Thread(target=boot, args=(i,)) for i in range(self.replicas)]
+        for t in booters: t.start()
+        for t in booters: t.join()
+        if errors:
+            self.close()
+            raise RuntimeError(f"Replica failed to start: {errors[0]}")
+
+        self._lock = threading.Lock()
+        self.inflight = [0] * self.replicas  # 每个副本上正在跑 + 排队的请求数
+        self.rate_window = rate_window
+        self._token_times = deque()          # 最近窗口内每个 token 的时间戳
+        self.stats = {"requests": 0, "tokens": 0, "queued": 0, "ttft_sum": 0.0, "ttft_count": 0}
+
+        self.client = self
+        self.chat = self
+        self.completions = self
+
+    def get_model_id(self): return f"Embedded-Stream (x{self.replicas})"
+
+    # ---------------- 派发 ----------------
+    def _acquire(self):
+        with self._lock:
+            idx = min(range(self.replicas), key=lambda i: self.inflight[i])
+            if self.inflight[idx] > 0: self.stats["queued"] += 1  # 所有副本都忙，只能排队
+            self.inflight[idx] += 1
+            self.stats["requests"] += 1
+            return idx
+
+    def create(self, model, messages, temperature=0.7, max_tokens=600, timeout=None, stream=False, **kwargs):
+        return self._track(dict(model=model, messages=messages, temperature=temperature,
+                                max_tokens=max_tokens, timeout=timeout, stream=True, **kwargs))
+
+    def _track(self, kwargs):
+        # 第一次迭代时才选副本并占位：生成器没被消费就丢掉的话不会泄漏名额
+        idx = self._acquire()
+        gen = None
+        t0 = time.perf_counter(); first = True
+        try:
+            gen = self.workers[idx].create(**kwargs)
+            for chunk in gen:
+                now = time.perf_counter()
+                with self._lock:
+                    if first:
+                        self.stats["ttft_sum"] += now - t0; self.stats["ttft_count"] += 1
+                        first = False
+                    self.stats["tokens"] += 1
+                    self._token_times.append(now)
+                    while now - self._token_times[0] > self.rate_window: self._token_times.popleft()
+                yield chunk
+        finally:
+            if gen is not None: gen.close()
+            with self._lock: self.inflight[idx] -= 1
+
+    # ---------------- 指标 ----------------
+    def get_pool_stats(self):
+        """聚合吞吐 (tok/s)、排队情况和每个副本的负载"""
+        with self._lock:
+            now = time.perf_counter()
+            while self._token_times and now - self._token_times[0] > self.rate_window:
+                self._token_times.popleft()
+            s = dict(self.stats)
+            s["tok_per_sec"] = len(self._token_times) / self.rate_window
+            s["inflight"] = list(self.inflight)
+            s["waiting"] = sum(max(0, n - 1) for n in self.inflight)  # 在副本内部排队的请求
+        s["replicas"] = self.replicas
+        s["avg_ttft"] = s.pop("ttft_sum") / s["ttft_count"] if s["ttft_count"] else 0.0
+        s.pop("ttft_count")
+        s["restarts"] = sum(w.restart_count for w in self.workers if w is not None)
+        return s
+
+    def close(self):
+        for w in self.workers:
+            if w is not None: w.close()
+
+# =========================================================================
+# 🧪 吞吐压测：K 个并发请求打满所有副本
+# =========================================================================
+def main():
+    parser = argparse.ArgumentParser(description="CAI 多副本推理池压测")
+    parser.add_argument("--replicas", type=int, default=None, help="副本数，默认每 4 核一个")
+    parser.add_argument("--threads", type=int, default=None, help="每个副本的推理线程数")
+    parser.add_argument("--model-file", default="model.gguf")
+    parser.add_argument("--requests", type=int, default=16, help="并发请求数")
+    args = parser.parse_args()
+
+    pool = LLMReplicaPool(replicas=args.replicas, threads_per_replica=args.threads, model_file=args.model_file)
+    prompt = [{"role": "user", "content": "用三句话介绍一下你自己。"}]
+    def one():
+        for _ in pool.create(model="local", messages=prompt, max_tokens=128): pass
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=one) for _ in range(args.requests)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - t0
+    stats = pool.get_pool_stats()
+    print(f"[Pool] {args.requests} 个请求用时 {elapsed:.1f}s，总吞吐 {stats['tokens'] / elapsed:.1f} tok/s")
+    print(f"[Pool] {stats}")
+    pool.close()
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    main()
@@ -1,7 +1,8 @@
 import os
 import sys
 import json
-import gc
+import threading
+import numpy as np
 
 # 1. 修复 DLL 路径
 def fix_llama_dll_path():
@@ -18,18 +19,18 @@ def fix_llama_dll_path():
                 except: pass
 fix_llama_dll_path()
 
-from llama_cpp import Llama
+from llama_cpp import Llama, LogitsProcessorList, llama_chat_format
 
 class LocalLLMService:
-    def __init__(self):
+    def __init__(self, model_file="model.gguf", speculative_prefill=False, n_threads=None):
         # 🟢 2. 核心修复：智能寻找模型路径 (支持 _internal)
         if getattr(sys, 'frozen', False):
             base_dir = os.path.dirname(sys.executable)
             
             # 可能性A: 用户手动复制到了 EXE 旁边
-            path_root = os.path.join(base_dir, "models", "model.gguf")
+            path_root = os.path.join(base_dir, "models", model_file)
             # 可能性B: PyInstaller 自动打包进了 _internal
-            path_internal = os.path.join(base_dir, "_internal", "models", "model.gguf")
+            path_internal = os.path.join(base_dir, "_internal", "models", model_file)
             
             if os.path.exists(path_root):
                 model_path = path_root
@@ -44,7 +45,7 @@ class LocalLLMService:
             # 开发环境
             current_dir = os.path.dirname(os.path.abspath(__file__))
             root_dir = os.path.dirname(current_dir)
-            model_path = os.path.join(root_dir, "models", "model.gguf")
+            model_path = os.path.join(root_dir, "models", model_file)
 
         print(f"[Core] Loading model from: {model_path}")
         
@@ -56,12 +57,33 @@ class LocalLLMService:
                 n_gpu_layers=-1, 
                 n_ctx=self.CTX_LIMIT,   
                 n_batch=self.BATCH_SIZE, 
+                use_mmap=True,  # 同一个 GGUF 被多个进程打开时共享页缓存
+                n_threads=n_threads,  # None = llama.cpp 默认；多副本时按核数均分
                 verbose=False
             )
             print(f"[Core] Model Ready.")
         except Exception as e:
             print(f"[Core] Load Failed: {e}"); raise e
 
+        # 🟢 投机预填充：用户还在说话时，先把 system + 历史 + 半句话算进 KV
+        self.speculative_prefill = speculative_prefill
+        self._formatter = self._build_formatter() if speculative_prefill else None
+        if speculative_prefill and self._formatter is None:
+            print("[Core] No chat template in GGUF, speculative prefill disabled.")
+            self.speculative_prefill = False
+        self._prefilled = []  # 上一次预填充的 token 序列
+        self._baseline = 0    # 本轮第一次预填充前 KV 里已有的前缀长度 (上一轮留下的，不算预填充的功劳)
+        self._step_conf = []  # 置信度探针：每一步采样前的最大概率
+        self._lock = threading.Lock()
+        self.prefill_stats = {
+            "speculations": 0,    # 实际执行的预填充次数
+            "prefill_tokens": 0,  # 预填充时 eval 的 token 数
+            "turns": 0,           # 带预填充的对话轮数
+            "kept": 0,            # 最终文本延续了预填充内容
+            "diverged": 0,        # 最终文本与预填充不一致 (预填充被丢弃)
+            "tokens_saved": 0,    # 正式请求时因预填充而免于 eval 的 token 数
+        }
+
         self.client = self 
         self.chat = self
         self.completions = self
@@ -78,16 +100,117 @@ class LocalLLMService:
             temp_msgs.pop(1)
         return temp_msgs
 
-    def create(self, model, messages, temperature=0.7, max_tokens=600, timeout=None, stream=False):
+    # ---------------- 投机预填充 ----------------
+    def _build_formatter(self):
+        # 与 create_chat_completion 使用同一份 GGUF 模板，保证 token 前缀一致
+        template = self.llm.metadata.get("tokenizer.chat_template")
+        if not template: return None
+        def token_text(tid): return self.llm._model.token_get_text(tid) if tid != -1 else ""
+        return llama_chat_format.Jinja2ChatFormatter(
+            template=template,
+            eos_token=token_text(self.llm.token_eos()),
+            bos_token=token_text(self.llm.token_bos()),
+        )
+
+    def _tokenize_prompt(self, prompt, formatted):
+        add_bos = not getattr(formatted, "added_special", False)
+        return self.llm.tokenize(prompt.encode("utf-8"), add_bos=add_bos, special=True)
+
+    def prefill(self, messages, max_tokens=600):
+        """
+        messages 的最后一条是用户尚未说完的半句话。
+        只把模板渲染到这半句话为止，后面的 token 等最终转写出来后再算。
+        返回本次新 eval 的 token 数 (正在生成时直接跳过，返回 0)。
+        """
+        if not self.speculative_prefill or not messages: return 0
+        if not self._lock.acquire(blocking=False): return 0
         try:
+            safe_messages = self._prune(messages, max_response_tokens=max_tokens)
+            partial = safe_messages[-1]['content']
+            formatted = self._formatter(messages=safe_messages)
+            cut = formatted.prompt.rfind(partial)
+            if not partial or cut < 0: return 0
+            tokens = self._tokenize_prompt(formatted.prompt[:cut + len(partial)], formatted)
+
+            # 只 eval 和当前 KV 不同的那一段，剩余部分直接覆盖
+            keep = Llama.longest_token_prefix(self.llm.input_ids.tolist(), tokens)
+            if not self._prefilled: self._baseline = keep
+            self._prefilled = tokens
+            if keep >= len(tokens): return 0
+            self.llm.n_tokens = keep
+            self.llm.eval(tokens[keep:])
+            self.prefill_stats["speculations"] += 1
+            self.prefill_stats["prefill_tokens"] += len(tokens) - keep
+            return len(tokens) - keep
+        except Exception as e:
+            print(f"[LLM Prefill Error] {e}")
+            self._prefilled = []
             self.llm.reset()
-            gc.collect()
+            return 0
+        finally:
+            self._lock.release()
+
+    def _account_prefill(self, safe_messages):
+        formatted = self._formatter(messages=safe_messages)
+        final_tokens = self._tokenize_prompt(formatted.prompt, formatted)
+        # generate() 会复用最长公共前缀 (至少留最后一个 token 给采样)
+        saved = Llama.longest_token_prefix(self.llm.input_ids.tolist(), final_tokens[:-1])
+        if self._prefilled:
+            # 只算预填充新增的那部分：上一轮留下的 KV 前缀不开预填充也能复用
+            self.prefill_stats["tokens_saved"] += max(0, saved - self._baseline)
+            self.prefill_stats["turns"] += 1
+            # 分词边界可能合并最后一个 token，因此允许差 1
+            if saved >= len(self._prefilled) - 1: self.prefill_stats["kept"] += 1
+            else: self.prefill_stats["diverged"] += 1
+            self._prefilled = []
+
+    def get_prefill_stats(self):
+        stats = dict(self.prefill_stats)
+        stats["keep_rate"] = stats["kept"] / stats["turns"] if stats["turns"] else 0.0
+        return stats
+
+    # ---------------- 置信度探针 (给级联路由用) ----------------
+    def _confidence_probe(self, input_ids, scores):
+        # 不改 logits，只记录这一步分布的最大概率 (softmax 的峰值)
+        top = scores.max()
+        self._step_conf.append(float(1.0 / np.exp(scores - top).sum()))
+        return scores
+
+    def _with_confidence(self, gen):
+        # 每个 chunk 附上自上一个 chunk 以来各步置信度的平均值
+        for chunk in gen:
+            if self._step_conf and chunk.get('choices'):
+                chunk['choices'][0]['confidence'] = sum(self._step_conf) / len(self._step_conf)
+                self._step_conf = []
+            yield chunk
+
+    def _hold(self, gen):
+        # 生成期间持有锁，避免 ASR 线程的预填充打乱正在使用的 KV
+        try:
+            yield from gen
+        finally:
+            self._lock.release()
+
+    def create(self, model, messages, temperature=0.7, max_tokens=600, timeout=None, stream=False, confidence=False):
+        self._lock.acquire()
+        try:
             safe_messages = self._prune(messages, max_response_tokens=max_tokens)
+            if self.speculative_prefill:
+                # 不 reset：保留预填充 (以及上一轮) 的 KV，generate 只会 eval 剩余后缀
+                self._account_prefill(safe_messages)
+            else:
+                self.llm.reset()
+            extra = {}
+            if confidence:
+                self._step_conf = []
+                extra["logits_processor"] = LogitsProcessorList([self._confidence_probe])
             output = self.llm.create_chat_completion(
-                messages=safe_messages, temperature=temperature, max_tokens=max_tokens, stream=True 
+                messages=safe_messages, temperature=temperature, max_tokens=max_tokens, stream=True, **extra
             )
-            return output 
+            if confidence: output = self._with_confidence(output)
+            return self._hold(output)
         except Exception as e:
             print(f"[LLM Error] {e}")
+            self._lock.release()
             def empty_gen(): yield {"choices":[{"delta":{"content": " (Error) "}}]}
             return empty_gen()
\ No newline at end of file
@@ -0,0 +1,290 @@
+import json
+import time
+import queue
+import socket
+import struct
+import argparse
+import threading
+from collections import deque
+
+import numpy as np
+
+from services.sherpa_asr_service import SherpaASRService
+
+# =========================================================================
+# 🎧 多路流式识别服务：所有连接共用一个识别器，每个 tick 把就绪的流一起解码
+# =========================================================================
+# 协议 (本地 TCP)：
+#   客户端 → 服务端：4 字节小端长度 + 16kHz 单声道 int16 PCM；长度为 0 表示说完了
+#       (长度必须是偶数且不超过 MAX_FRAME，否则服务端直接断开)
+#   服务端 → 客户端：一行一个 JSON
+#       {"type": "partial", "text": "..."}
+#       {"type": "final", "text": "...", "latency_ms": 12.3}
+#       {"type": "end"}   (收到结束帧并处理完后发送，随后关闭连接)
+
+SAMPLE_RATE = 16000
+_LEN = struct.Struct("<I")
+MAX_FRAME = SAMPLE_RATE * 2 * 10  # 单帧最多 10 秒音频，超过就当作协议错误
+
+def _recv_exact(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        part = sock.recv(n - len(buf))
+        if not part: return None
+        buf += part
+    return bytes(buf)
+
+class _Client:
+    OUTBOX_SIZE = 256  # 积压这么多条还没发出去，说明对方读得太慢，直接断开
+
+    def __init__(self, sock, addr, stream):
+        self.sock = sock
+        self.addr = addr
+        self.stream = stream
+        self.outbox = queue.Queue(maxsize=self.OUTBOX_SIZE)
+        self.last_text = ""
+        self.pending_since = None  # 最早一块还没解码的音频到达的时间
+        self.finishing = False     # 客户端已发送结束帧
+        self.closed = False
+        # 🟢 每个连接一个发送线程：解码线程只管入队，慢客户端不会拖住其他人
+        threading.Thread(target=self._writer, name=f"ASR-Send-{addr}", daemon=True).start()
+
+    def send(self, event):
+        """非阻塞：放进发送队列；队列满了就断开这个客户端，返回 False"""
+        if self.closed: return False
+        try:
+            self.outbox.put_nowait((json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8"))
+            return True
+        except queue.Full:
+            print(f"[ASR Server] {self.addr} 接收太慢，断开")
+            self.abort()
+            return False
+
+    def finish(self):
+        """已入队的事件发完后关闭连接"""
+        try: self.outbox.put_nowait(None)
+        except queue.Full: self.abort()
+
+    def abort(self):
+        # shutdown 会让读线程的 recv 和发送线程的 sendall 立刻返回
+        self.closed = True
+        try: self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError: pass
+
+    def _writer(self):
+        while True:
+            line = self.outbox.get()
+            if line is None: break
+            try: self.sock.sendall(line)
+            except OSError:
+                self.closed = True; break
+        try: self.sock.close()
+        except OSError: pass
+
+class StreamingASRServer:
+    def __init__(self, asr, host="127.0.0.1", port=6006, tick=0.02):
+        """
+        :param asr: SherpaASRService，建议 num_threads>1、enable_endpoint=True
+        :param tick: 没有就绪的流时，解码线程休眠的间隔 (秒)
+        """
+        self.asr = asr
+        self.recognizer = asr.recognizer
+        self.host = host
+        self.port = port
+        self.tick = tick
+        self.clients = []
+        self.lock = threading.Lock()  # 保护 clients 以及识别器上的所有操作
+        self.running = False
+
+        self.latencies = deque(maxlen=1000)  # 最近的每流解码延迟 (秒)
+        self.stats = {"connections": 0, "peak_streams": 0, "batches": 0, "batched_streams": 0,
+                      "audio_sec": 0.0, "decode_sec": 0.0}
+
+    # ---------------- 连接处理 ----------------
+    def serve_forever(self):
+        self.running = True
+        threading.Thread(target=self._decode_loop, name="ASR-Decode", daemon=True).start()
+        server = socket.create_server((self.host, self.port))
+        print(f"[ASR Server] 监听 {self.host}:{self.port}")
+        try:
+            while self.running:
+                sock, addr = server.accept()
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                threading.Thread(target=self._reader, args=(sock, addr), daemon=True).start()
+        finally:
+            self.running = False
+            server.close()
+
+    def _reader(self, sock, addr):
+        with self.lock:
+            client = _Client(sock, addr, self.recognizer.create_stream())
+            self.clients.append(client)
+            self.stats["connections"] += 1
+            self.stats["peak_streams"] = max(self.stats["peak_streams"], len(self.clients))
+        finishing = False
+        try:
+            while not client.closed:
+                header = _recv_exact(sock, _LEN.size)
+                if header is None: break
+                (n,) = _LEN.unpack(header)
+                if n % 2 or n > MAX_FRAME:
+                    # int16 帧长度必须是偶数；过大的长度多半是错位的帧头，不能照单全收
+                    print(f"[ASR Server] {addr} 非法帧长度 {n}，断开"); break
+                if n == 0:
+                    with self.lock:
+                        # 补一点静音再结束，让模型吐出最后几个字
+                        client.stream.accept_waveform(SAMPLE_RATE, np.zeros(SAMPLE_RATE // 2, dtype=np.float32))
+                        client.stream.input_finished()
+                        client.finishing = True
+                    finishing = True
+                    return
+                payload = _recv_exact(sock, n)
+                if payload is None: break
+                samples = np.frombuffer(payload, dtype=np.int16).astype(np.float32) / 32768.0
+                with self.lock:
+                    client.stream.accept_waveform(SAMPLE_RATE, samples)
+                    if client.pending_since is None: client.pending_since = time.perf_counter()
+                    self.stats["audio_sec"] += len(samples) / SAMPLE_RATE
+        except (OSError, ValueError) as e:
+            print(f"[ASR Server] {addr} 连接异常: {e}")
+        finally:
+            # 除了正常的结束帧，其他任何退出 (断开 / 协议错误 / 异常) 都直接丢弃这路流
+            if not finishing:
+                with self.lock:
+                    client.closed = True
+                    self._drop(client)
+
+    def _drop(self, client):
+        if client in self.clients: self.clients.remove(client)
+        client.abort()
+        client.finish()  # 让发送线程退出并关闭 socket
+
+    # ---------------- 批量解码 ----------------
+    def _decode_loop(self):
+        while self.running:
+            with self.lock:
+                # 因为太慢被断开、但读线程已经退出的客户端在这里清掉
+                for c in [c for c in self.clients if c.closed]: self._drop(c)
+                ready = [c for c in self.clients if not c.closed and self.recognizer.is_ready(c.stream)]
+                if ready:
+                    t0 = time.perf_counter()
+                    # 🟢 一次调用解码所有就绪的流，识别器内部多线程并行
+                    self.recognizer.decode_streams([c.stream for c in ready])
+                    self.stats["decode_sec"] += time.perf_counter() - t0
+                    self.stats["batches"] += 1
+                    self.stats["batched_streams"] += len(ready)
+                events = self._collect_events(ready)
+            # 只入队不阻塞：真正的发送在各客户端自己的线程里
+            for client, event in events:
+                client.send(event)
+                if event["type"] == "end": client.finish()
+            if not ready: time.sleep(self.tick)
+
+    def _collect_events(self, ready):
+        """在锁内读取识别结果，返回 (客户端, 事件) 列表，发送放到锁外"""
+        events = []; now = time.perf_counter()
+        for client in ready:
+            if self.recognizer.is_ready(client.stream): continue  # 还有没解完的，下个 tick 再看
+            latency = None
+            if client.pending_since is not None:
+                latency = now - client.pending_since
+                self.latencies.append(latency)
+                client.pending_since = None
+
+            text = self.recognizer.get_result(client.stream)
+            if text != client.last_text and text.strip():
+                client.last_text = text
+                events.append((client, {"type": "partial", "text": text}))
+
+            if self.recognizer.is_endpoint(client.stream) or client.finishing:
+                if text.strip():
+                    events.append((client, {"type": "final", "text": text,
+                                            "latency_ms": round((latency or 0.0) * 1000, 1)}))
+                self.recognizer.reset(client.stream)
+                client.last_text = ""
+                if client.finishing:
+                    events.append((client, {"type": "end"}))
+                    self.clients.remove(client)
+        return events
+
+    def get_stats(self):
+        """当前/峰值并发、平均批大小、每流延迟，以及按解码耗时估算的实时并发容量"""
+        with self.lock:
+            s = dict(self.stats)
+            s["active_streams"] = len(self.clients)
+            lat = sorted(self.latencies)
+        s["avg_batch"] = s["batched_streams"] / s["batches"] if s["batches"] else 0.0
+        # 解码 1 秒耗时能处理多少秒音频 ≈ 能实时支撑的并发路数
+        s["est_capacity"] = s["audio_sec"] / s["decode_sec"] if s["decode_sec"] else 0.0
+        if lat:
+            s["latency_ms_p50"] = round(lat[len(lat) // 2] * 1000, 1)
+            s["latency_ms_p95"] = round(lat[int(len(lat) * 0.95)] * 1000, 1)
+        return s
+
+# =========================================================================
+# 🧪 压测客户端：N 路并发按实时速度推送同一个 wav
+# =========================================================================
+def stream_wav(host, port, samples, chunk_ms=100, realtime=True):
+    """按 chunk_ms 分块推送 int16 音频，返回 final 结果列表"""
+    sock = socket.create_connection((host, port))
+    chunk = SAMPLE_RATE * chunk_ms // 1000
+    results = []
+    reader = sock.makefile("r", encoding="utf-8")
+    def collect():
+        for line in reader:
+            event = json.loads(line)
+            if event["type"] == "final": results.append(event["text"])
+            if event["type"] == "end": break
+    t = threading.Thread(target=collect, daemon=True); t.start()
+    for i in range(0, len(samples), chunk):
+        data = samples[i:i + chunk].tobytes()
+        sock.sendall(_LEN.pack(len(data)) + data)
+        if realtime: time.sleep(chunk_ms / 1000)
+    sock.sendall(_LEN.pack(0))
+    t.join()
+    sock.close()
+    return results
+
+def _bench(server, wav_path, n_clients):
+    import wave
+    with wave.open(wav_path, "rb") as f:
+        if f.getframerate() != SAMPLE_RATE or f.getsampwidth() != 2 or f.getnchannels() != 1:
+            raise ValueError("压测音频需要是 16kHz 单声道 16-bit wav")
+        samples = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+    threads = [threading.Thread(target=stream_wav, args=(server.host, server.port, samples), daemon=True)
+               for _ in range(n_clients)]
+    t0 = time.perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    print(f"[ASR Bench] {n_clients} 路并发完成，用时 {time.perf_counter() - t0:.1f}s")
+    print(f"[ASR Bench] {server.get_stats()}")
+
+def main():
+    parser = argparse.ArgumentParser(description="CAI 多路流式语音识别服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6006)
+    parser.add_argument("--threads", type=int, default=4, help="识别器解码线程数")
+    parser.add_argument("--stats-interval", type=float, default=0, help="每隔多少秒打印一次统计，0 不打印")
+    parser.add_argument("--bench", type=int, default=0, help="启动后用 N 路并发客户端压测 (需配合 --wav)")
+    parser.add_argument("--wav", help="压测用的 16kHz 单声道 wav")
+    args = parser.parse_args()
+
+    asr = SherpaASRService(num_threads=args.threads, enable_endpoint=True)
+    server = StreamingASRServer(asr, host=args.host, port=args.port)
+
+    if args.stats_interval > 0:
+        def report():
+            while True:
+                time.sleep(args.stats_interval)
+                print(f"[ASR Server] {server.get_stats()}")
+        threading.Thread(target=report, daemon=True).start()
+
+    if args.bench:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        time.sleep(0.5)
+        _bench(server, args.wav, args.bench)
+        return
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -4,9 +4,14 @@ import numpy as np
 import sys
 import os
 import time
+import wave
 
 class SherpaASRService:
-    def __init__(self):
+    def __init__(self, num_threads=1, enable_endpoint=False):
+        """
+        :param num_threads: 解码线程数。多路服务模式下多个流一起解码，可以调大
+        :param enable_endpoint: 打开模型自带的断句 (静音) 检测，服务模式用它判断一句话结束
+        """
         model_dir = "asr_model"
         
         # 1. 检查文件
@@ -25,21 +30,25 @@ class SherpaASRService:
                 encoder=f"{model_dir}/encoder.onnx",
                 decoder=f"{model_dir}/decoder.onnx",
                 joiner=f"{model_dir}/joiner.onnx",
-                num_threads=1,
+                num_threads=num_threads,
                 sample_rate=16000,
                 feature_dim=80,
                 decoding_method="greedy_search",
+                enable_endpoint_detection=enable_endpoint,
             )
         except Exception as e:
             print(f"❌ 模型加载失败: {e}")
             print("💡 提示：可能是文件损坏或 tokens.txt 与模型不匹配。")
             raise e
 
+        # 最近一句话的计时 (perf_counter)：speech_start 为第一个字识别出来的时刻，decode_sec 为解码累计耗时
+        self.last_timing = {"speech_start": None, "decode_sec": 0.0}
         print("[ASR] 耳朵已修复并就绪。")
 
-    def listen(self):
+    def listen(self, on_partial=None, partial_stable=0.3):
         """
         监听麦克风
+        :param on_partial: 中间结果稳定 partial_stable 秒后回调 (用于投机预填充)，同一文本只回调一次
         """
         stream = self.recognizer.create_stream()
         sample_rate = 16000
@@ -50,18 +59,24 @@ class SherpaASRService:
         last_text = ""
         last_change_time = 0
         silence_threshold = 1.0 # 停顿 1 秒判定为说完
+        last_partial = ""
+        timing = {"speech_start": None, "decode_sec": 0.0}
+        self.last_timing = timing
         
         with sd.InputStream(channels=1, dtype="float32", samplerate=sample_rate) as s:
             while True:
                 samples, _ = s.read(chunk_size)
                 samples = samples.reshape(-1)
                 stream.accept_waveform(sample_rate, samples)
+                t0 = time.perf_counter()
                 while self.recognizer.is_ready(stream):
                     self.recognizer.decode_stream(stream)
+                timing["decode_sec"] += time.perf_counter() - t0
                 
                 text = self.recognizer.get_result(stream)
                 
                 if text:
+                    if timing["speech_start"] is None: timing["speech_start"] = time.perf_counter()
                     sys.stdout.write(f"\r[正在听]: {text}")
                     sys.stdout.flush()
                     
@@ -69,7 +84,11 @@ class SherpaASRService:
                         last_text = text
                         last_change_time = time.time()
                     else:
-                        if (time.time() - last_change_time) > silence_threshold:
+                        stable_for = time.time() - last_change_time
+                        if on_partial and text != last_partial and stable_for > partial_stable:
+                            last_partial = text
+                            on_partial(text)
+                        if stable_for > silence_threshold:
                             print(f"\n[检测到停顿]: 提交结果。")
                             return text
                             
@@ -80,4 +99,31 @@ class SherpaASRService:
                         print(f"\n[自动断句]: {final_text}")
                         return final_text
                     else:
-                        self.recognizer.reset(stream)
\ No newline at end of file
+                        self.recognizer.reset(stream)
+                        timing["speech_start"] = None
+
+    def listen_file(self, path):
+        """
+        识别一个 wav 文件 (无头模式/离线测试用)，返回整段文本
+        """
+        with wave.open(path, "rb") as f:
+            sample_rate = f.getframerate()
+            channels = f.getnchannels()
+            width = f.getsampwidth()
+            frames = f.readframes(f.getnframes())
+        if width != 2:
+            raise ValueError(f"只支持 16-bit PCM wav: {path}")
+        samples = np.frombuffer(frames, dtype=np.int16).astype(np.float32) / 32768.0
+        if channels > 1:
+            samples = samples.reshape(-1, channels)[:, 0]
+
+        t0 = time.perf_counter()
+        stream = self.recognizer.create_stream()
+        stream.accept_waveform(sample_rate, samples)
+        # 尾部补 0.5 秒静音，让模型吐出最后几个字
+        stream.accept_waveform(sample_rate, np.zeros(int(sample_rate * 0.5), dtype=np.float32))
+        stream.input_finished()
+        while self.recognizer.is_ready(stream):
+            self.recognizer.decode_stream(stream)
+        self.last_timing = {"speech_start": t0, "decode_sec": time.perf_counter() - t0}
+        return self.recognizer.get_result(stream)
@@ -8,6 +8,8 @@ import queue
 import time
 import re
 
+from core.speech_chunker import SegmentPacker, split_by_weight
+
 class AudioStreamManager:
     def __init__(self, sample_rate=22050):
         self.sample_rate = sample_rate
@@ -98,6 +100,13 @@ class SherpaTTSService:
         self.audio_mgr = AudioStreamManager(self.tts.sample_rate)
         self.audio_mgr.set_volume(2.0)
 
+        # 🟢 短句打包：相邻短句合成一次；第一组凑够 first_len 个字就先发，保证首包延迟
+        self.packer = SegmentPacker()
+        self.rtf_stats = {"calls": 0, "segments": 0, "synth_sec": 0.0, "audio_sec": 0.0}
+        self._speak_q = queue.Queue()
+        self._speak_thread = None
+        self._epoch = 0  # stop() 时自增，正在合成的旧任务据此作废
+
     def set_volume(self, v): self.audio_mgr.set_volume(v)
 
     def _split_text(self, text):
@@ -110,18 +119,88 @@ class SherpaTTSService:
         if current: sentences.append(current)
         return [s for s in sentences if s.strip()]
 
+    def synthesize_batch(self, segments):
+        """
+        一次 generate 合成多句，再按字数比例切回每句各自的音频。
+        返回与 segments 一一对应的 float32 数组列表。
+        """
+        t0 = time.perf_counter()
+        audio = self.tts.generate("".join(segments))
+        if hasattr(audio, 'samples') and len(audio.samples) > 0:
+            samples = np.array(audio.samples, dtype=np.float32)
+        else:
+            samples = np.zeros(0, dtype=np.float32)
+        self.rtf_stats["calls"] += 1
+        self.rtf_stats["segments"] += len(segments)
+        self.rtf_stats["synth_sec"] += time.perf_counter() - t0
+        self.rtf_stats["audio_sec"] += len(samples) / self.tts.sample_rate
+        return split_by_weight(samples, segments)
+
+    def get_rtf(self):
+        """实时率 = 合成耗时 / 音频时长，越小越好"""
+        s = self.rtf_stats
+        return s["synth_sec"] / s["audio_sec"] if s["audio_sec"] else 0.0
+
+    def synthesize(self, text, first_alone=True):
+        """只合成不播放，返回 float32 音频 (无头流水线用)"""
+        chunks = []
+        for group in self.packer.pack(self._split_text(text) or [text], first_alone=first_alone):
+            chunks.extend(self.synthesize_batch(group))
+        if not chunks: return np.zeros(0, dtype=np.float32)
+        return np.concatenate(chunks)
+
+    def _play_segments(self, segments, first_alone=True, epoch=None):
+        if epoch is None: epoch = self._epoch
+        for group in self.packer.pack(segments, first_alone=first_alone):
+            if self.audio_mgr.is_stopped or epoch != self._epoch: return
+            for piece in self.synthesize_batch(group):
+                # 按原句边界逐段入队，停止时不会把整包都念完
+                if epoch != self._epoch: return
+                if len(piece) > 0: self.audio_mgr.play_chunk(piece)
+
     def speak(self, text):
         if not text: return
         self.audio_mgr.is_stopped = False
         try:
-            sentences = self._split_text(text)
-            if not sentences: sentences = [text]
-            for sent in sentences:
-                if self.audio_mgr.is_stopped: break
-                audio = self.tts.generate(sent)
-                if hasattr(audio, 'samples') and len(audio.samples) > 0:
-                    self.audio_mgr.play_chunk(np.array(audio.samples))
+            self._play_segments(self._split_text(text) or [text])
             self.audio_mgr.wait()
         except: pass
 
-    def stop(self): self.audio_mgr.stop()
\ No newline at end of file
+    def enqueue(self, text):
+        """
+        流式场景用：句子逐条丢进来，由一个后台线程按顺序合成播放。
+        合成忙的时候积压的短句会被打包成一次 generate。
+        """
+        if not text or not text.strip(): return
+        # 入队时就记下当前 epoch：在 stop() 之前排进来的句子即使晚一步才被取出，也不会再念
+        self._speak_q.put((self._epoch, text))
+        if self._speak_thread is None or not self._speak_thread.is_alive():
+            self._speak_thread = threading.Thread(target=self._speak_loop, daemon=True)
+            self._speak_thread.start()
+
+    def _speak_loop(self):
+        held = []  # 合并时多取出来、属于更新一轮 (stop 之后) 的那一项
+        while True:
+            epoch, text = held.pop() if held else self._speak_q.get()
+            if epoch < self._epoch: continue  # stop() 之前排进来的，作废
+            segments = self._split_text(text)
+            while True:
+                try: nxt_epoch, nxt = self._speak_q.get_nowait()
+                except queue.Empty: break
+                if nxt_epoch < self._epoch: continue
+                if nxt_epoch != epoch:
+                    # 新一轮回复的开头：留到下一次循环，不能丢
+                    held.append((nxt_epoch, nxt)); break
+                segments += self._split_text(nxt)
+            try:
+                # 播放器空闲说明这是一段回复的开头，第一组只凑够 first_len 个字就先合成
+                self._play_segments(segments, first_alone=self.audio_mgr.q.empty(), epoch=epoch)
+            except Exception as e:
+                print(f"[TTS Error] {e}")
+
+    def stop(self):
+        self._epoch += 1
+        while True:
+            try: self._speak_q.get_nowait()
+            except queue.Empty: break
+        self.audio_mgr.stop()
\ No newline at end of file
@@ -1,15 +1,32 @@
 import sys, os, time, traceback, ctypes, re
+import multiprocessing
+from collections import OrderedDict
 from ctypes import c_int, byref
 from ctypes.wintypes import HWND, DWORD
 from PySide6.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout, 
-                               QTextBrowser, QLineEdit, QPushButton, QLabel, 
-                               QSlider, QFrame, QScrollArea, QSizePolicy)
-from PySide6.QtCore import Qt, QTimer, QThreadPool, QRunnable, Signal, QObject, Slot, QSize, QPoint, QRect
-from PySide6.QtGui import QPainter, QColor, QFont, QPen, QBrush, QConicalGradient, QTextCursor, QIcon, QLinearGradient
+                               QListView, QLineEdit, QPushButton, QLabel, 
+                               QSlider, QFrame, QScrollArea, QSizePolicy, QStyledItemDelegate,
+                               QAbstractItemView)
+from PySide6.QtCore import (Qt, QTimer, QThreadPool, QRunnable, Signal, QObject, Slot, QSize, QPoint, QRect,
+                            QAbstractListModel, QModelIndex)
+from PySide6.QtGui import (QPainter, QColor, QFont, QPen, QBrush, QConicalGradient, QIcon, QLinearGradient,
+                           QTextDocument, QTextOption, QAbstractTextDocumentLayout, QPalette)
 
 from services.sherpa_service import SherpaTTSService 
-from services.local_llm_service import LocalLLMService 
+from services.llm_process_service import LLMProcessService 
 from core.cai_brain import CAIBrain
+from core.memory_governor import MemoryGovernor
+from config import settings
+
+def model_exists(model_file):
+    """按 LocalLLMService 的查找顺序检查 models/ 下的模型文件 (主进程不导入 llama_cpp)"""
+    if getattr(sys, 'frozen', False):
+        base_dir = os.path.dirname(sys.executable)
+        candidates = [os.path.join(base_dir, "models", model_file),
+                      os.path.join(base_dir, "_internal", "models", model_file)]
+    else:
+        candidates = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", model_file)]
+    return any(os.path.exists(p) for p in candidates)
 
 # =========================================================================
 # 🪄 Windows 磨砂特效
@@ -50,7 +67,7 @@ class ModernStyles:
     QLabel#TitleLabel { color: #ffffff; font-weight: 600; font-size: 15px; }
     QLabel#StatusLabel { color: #aaa; font-size: 11px; }
     
-    QTextBrowser { background-color: transparent; border: none; selection-background-color: #007acc; }
+    QListView#ChatView { background-color: transparent; border: none; padding: 10px; }
     
     QFrame#ControlBar { background-color: rgba(0, 0, 0, 0.15); border-radius: 10px; margin: 0 10px; }
     QFrame#InputContainer { background-color: rgba(30, 30, 40, 0.5); border: 1px solid rgba(255, 255, 255, 0.1); border-radius: 10px; margin: 5px 10px 10px 10px; }
@@ -91,12 +108,210 @@ class MiniAvatar(QWidget):
             p.drawEllipse(QPoint(18, 18), int(r+4), int(r+4))
         except: pass
 
+# =========================================================================
+# 💬 聊天列表 (虚拟化)：只画可见的气泡，窗口内最多保留 MAX_ROWS 条
+# =========================================================================
+class ChatListModel(QAbstractListModel):
+    MAX_ROWS = 200   # 常驻内存的消息上限，超出就从顶部丢弃 (需要时再从硬盘翻回来)
+    PAGE_SIZE = 30   # 每次向上翻页读取的条数
+    MessageRole = Qt.UserRole + 1
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.rows = []          # {"uid", "role", "text", "done", "tindex"}
+        self.memory_mgr = None
+        self.oldest_index = 0   # 窗口里最早那条持久化消息在聊天记录中的序号
+        self._next_uid = 0
+
+    def _make_row(self, role, text, done=True, tindex=None):
+        self._next_uid += 1
+        return {"uid": self._next_uid, "role": role, "text": text, "done": done, "tindex": tindex}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid(): return None
+        row = self.rows[index.row()]
+        if role == Qt.DisplayRole: return row["text"]
+        if role == self.MessageRole: return row
+        return None
+
+    # ---------------- 绑定记忆存储 ----------------
+    def attach_memory(self, memory_mgr):
+        """从聊天记录里加载最近一页"""
+        self.memory_mgr = memory_mgr
+        total = memory_mgr.transcript_length()
+        start = max(0, total - self.PAGE_SIZE)
+        self.beginResetModel()
+        self.rows = [self._make_row(m["role"], m["content"], tindex=start + i)
+                     for i, m in enumerate(memory_mgr.load_transcript(start, total - start))]
+        self.oldest_index = start
+        self.endResetModel()
+
+    def can_load_older(self):
+        return self.memory_mgr is not None and self.oldest_index > 0
+
+    def load_older(self):
+        """把更早的一页插到顶部，返回插入的条数"""
+        if not self.can_load_older(): return 0
+        start = max(0, self.oldest_index - self.PAGE_SIZE)
+        older = self.memory_mgr.load_transcript(start, self.oldest_index - start)
+        if not older: return 0
+        self.beginInsertRows(QModelIndex(), 0, len(older) - 1)
+        self.rows[0:0] = [self._make_row(m["role"], m["content"], tindex=start + i) for i, m in enumerate(older)]
+        self.oldest_index = start
+        self.endInsertRows()
+        return len(older)
+
+    def trim(self):
+        """窗口超过上限时从顶部丢弃；返回被丢弃的 uid，方便清理排版缓存"""
+        extra = len(self.rows) - self.MAX_ROWS
+        if extra <= 0: return []
+        dropped = self.rows[:extra]
+        self.beginRemoveRows(QModelIndex(), 0, extra - 1)
+        del self.rows[:extra]
+        for row in dropped:
+            if row["tindex"] is not None: self.oldest_index = row["tindex"] + 1
+        self.endRemoveRows()
+        return [row["uid"] for row in dropped]
+
+    # ---------------- 追加 / 流式更新 ----------------
+    def append_message(self, role, text, done=True, persist=False):
+        tindex = None
+        if persist and self.memory_mgr is not None:
+            tindex = self.memory_mgr.append_transcript(role, text)
+        n = len(self.rows)
+        self.beginInsertRows(QModelIndex(), n, n)
+        self.rows.append(self._make_row(role, text, done=done, tindex=tindex))
+        self.endInsertRows()
+        return self.index(n, 0)
+
+    def insert_status(self, text):
+        """在正在流式输出的消息上方插一条状态行 (只显示，不写入聊天记录)"""
+        n = len(self.rows)
+        if n and not self.rows[-1]["done"]: n -= 1
+        self.beginInsertRows(QModelIndex(), n, n)
+        self.rows.insert(n, self._make_row("system", text))
+        self.endInsertRows()
+
+    def append_token(self, token):
+        if not self.rows or self.rows[-1]["done"]: return None
+        self.rows[-1]["text"] += token
+        index = self.index(len(self.rows) - 1, 0)
+        self.dataChanged.emit(index, index)
+        return index
+
+    def finish_last(self):
+        """流式消息结束：写入聊天记录，之后它的排版可以被缓存"""
+        if not self.rows or self.rows[-1]["done"]: return
+        row = self.rows[-1]
+        row["done"] = True
+        if row["text"].strip() and self.memory_mgr is not None:
+            row["tindex"] = self.memory_mgr.append_transcript(row["role"], row["text"])
+        index = self.index(len(self.rows) - 1, 0)
+        self.dataChanged.emit(index, index)
+
+    def clear(self):
+        self.beginResetModel()
+        self.rows = []
+        self.oldest_index = 0
+        self.endResetModel()
+
+class ChatBubbleDelegate(QStyledItemDelegate):
+    PAD_X, PAD_Y, MARGIN = 12, 8, 4
+    CACHE_SIZE = 400
+    STYLES = {
+        "user": {"bg": QColor("#007acc"), "fg": QColor("white"), "ratio": 0.75, "font": 14},
+        "assistant": {"bg": QColor(255, 255, 255, 25), "fg": QColor("#eee"), "ratio": 0.85, "font": 14},
+        "system": {"bg": None, "fg": QColor("#888"), "ratio": 1.0, "font": 11},
+    }
+
+    def __init__(self, view):
+        super().__init__(view)
+        self.view = view
+        self.cache = OrderedDict()   # (uid, 宽度) -> 排好版的 QTextDocument，只缓存已完成的消息
+        self._stream_height = {}     # 流式消息上次的高度，高度变了才触发重新布局
+
+    def _style(self, role): return self.STYLES.get(role, self.STYLES["system"])
+
+    def _document(self, row, width):
+        key = (row["uid"], width)
+        if row["done"] and key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        style = self._style(row["role"])
+        doc = QTextDocument()
+        font = QFont(); font.setPixelSize(style["font"]); doc.setDefaultFont(font)
+        option = QTextOption(Qt.AlignCenter if row["role"] == "system" else Qt.AlignLeft)
+        option.setWrapMode(QTextOption.WrapAtWordBoundaryOrAnywhere)
+        doc.setDefaultTextOption(option)
+        doc.setDocumentMargin(0)
+        text = f"— {row['text']} —" if row["role"] == "system" else row["text"]
+        doc.setPlainText(text)
+        max_text = max(20, int(width * style["ratio"]) - 2 * (self.PAD_X + self.MARGIN))
+        doc.setTextWidth(max_text)
+        if row["role"] != "system":
+            doc.setTextWidth(min(max_text, doc.idealWidth() + 1))  # 短消息的气泡收窄
+
+        if row["done"]:
+            self.cache[key] = doc
+            if len(self.cache) > self.CACHE_SIZE: self.cache.popitem(last=False)
+        return doc
+
+    def forget(self, uids):
+        uids = set(uids)
+        for key in [k for k in self.cache if k[0] in uids]: del self.cache[key]
+
+    def _height(self, row):
+        doc = self._document(row, self.view.viewport().width())
+        return int(doc.size().height()) + 2 * (self.PAD_Y + self.MARGIN)
+
+    def sizeHint(self, option, index):
+        row = index.data(ChatListModel.MessageRole)
+        return QSize(self.view.viewport().width(), self._height(row))
+
+    def watch_stream(self, index):
+        """流式消息每来一个 token 调一次；只有行数变化时才让列表重新布局"""
+        row = index.data(ChatListModel.MessageRole)
+        h = self._height(row)
+        if self._stream_height.get(row["uid"]) != h:
+            self._stream_height = {row["uid"]: h}
+            self.sizeHintChanged.emit(index)
+
+    def paint(self, painter, option, index):
+        row = index.data(ChatListModel.MessageRole)
+        style = self._style(row["role"])
+        doc = self._document(row, option.rect.width())
+        w, h = int(doc.size().width()), int(doc.size().height())
+        bubble = QRect(0, 0, w + 2 * self.PAD_X, h + 2 * self.PAD_Y)
+        top = option.rect.top() + self.MARGIN
+        if row["role"] == "user":
+            bubble.moveTopRight(QPoint(option.rect.right() - self.MARGIN, top))
+        elif row["role"] == "assistant":
+            bubble.moveTopLeft(QPoint(option.rect.left() + self.MARGIN, top))
+        else:
+            bubble.moveTopLeft(QPoint(option.rect.left() + (option.rect.width() - bubble.width()) // 2, top))
+
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing)
+        if style["bg"] is not None:
+            painter.setPen(Qt.NoPen); painter.setBrush(style["bg"])
+            painter.drawRoundedRect(bubble, 12, 12)
+        painter.translate(bubble.left() + self.PAD_X, bubble.top() + self.PAD_Y)
+        ctx = QAbstractTextDocumentLayout.PaintContext()
+        ctx.palette.setColor(QPalette.Text, style["fg"])
+        doc.documentLayout().draw(painter, ctx)
+        painter.restore()
+
 # =========================================================================
 # ⚙️ 核心逻辑 (终极清洗 - 双缓冲模式)
 # =========================================================================
 class StreamWorkerSignals(QObject):
     new_token = Signal(str); new_sentence = Signal(str); finished = Signal(); 
     status_update = Signal(str)
+    think_started = Signal()  # 模型开始 <think>：由界面显示占位提示，不混进回复正文
 
 class StreamWorker(QRunnable):
     def __init__(self, brain_func, text):
@@ -128,10 +343,7 @@ class StreamWorker(QRunnable):
                         self.signals.status_update.emit("🧠 Deep Thinking...")
                         
                         if not has_emitted_think_placeholder:
-                             self.signals.new_token.emit(
-                                "<div style='color:#666; font-size:12px; margin:5px 0; font-style:italic; border-left: 2px solid #555; padding-left: 5px;'>"
-                                "Thinking Process Hidden...</div>"
-                            )
+                             self.signals.think_started.emit()
                              has_emitted_think_placeholder = True
                         
                         pre_text = buffer.split("<think>")[0]
@@ -185,6 +397,8 @@ class StreamWorker(QRunnable):
 # 🖥️ 主界面
 # =========================================================================
 class MainWindow(QWidget):
+    mem_shrink = Signal()  # 内存管家在后台线程里触发，界面收缩必须回到主线程做
+
     def __init__(self):
         super().__init__()
         self.setObjectName("MainWindow")
@@ -226,8 +440,16 @@ class MainWindow(QWidget):
         hl.addWidget(min_btn); hl.addWidget(close_btn)
         main_layout.addWidget(header)
         
-        self.chat = QTextBrowser(); self.chat.setOpenExternalLinks(True)
-        self.chat.setStyleSheet("padding: 10px;") 
+        # 🟢 模型/视图：只有可见的气泡会被排版和绘制，会话再长每条消息的开销也不变
+        self.chat = QListView(); self.chat.setObjectName("ChatView")
+        self.chat_model = ChatListModel(self)
+        self.chat_delegate = ChatBubbleDelegate(self.chat)
+        self.chat.setModel(self.chat_model); self.chat.setItemDelegate(self.chat_delegate)
+        self.chat.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.chat.setResizeMode(QListView.Adjust)
+        self.chat.setSelectionMode(QAbstractItemView.NoSelection)
+        self.chat.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.chat.verticalScrollBar().valueChanged.connect(self.on_chat_scroll)
         main_layout.addWidget(self.chat)
         
         ctrl_bar = QFrame(); ctrl_bar.setObjectName("ControlBar"); ctrl_bar.setFixedHeight(45)
@@ -268,15 +490,46 @@ class MainWindow(QWidget):
 
     def init_backend(self):
         try:
-            self.llm = LocalLLMService()
+            # 🟢 模型在独立进程里推理，UI 和音频回调不再被 token 解码卡住
+            self.llm = LLMProcessService()
             self.tts = SherpaTTSService()
-            self.brain = CAIBrain(self.llm)
+            # 小模型 (models/model-small.gguf) 第一次遇到闲聊时才加载；没有这个文件就不开路由，全部走大模型
+            small = None
+            if model_exists("model-small.gguf"):
+                small = lambda: LLMProcessService(model_file="model-small.gguf")
+            self.brain = CAIBrain(self.llm, small_llm_service=small)
+            self.chat_model.attach_memory(self.brain.memory_mgr)
+            self.chat.scrollToBottom()
+            self.init_governor()
             self.status_lbl.setText("Online")
             self.append_system_msg("系统就绪")
         except Exception as e:
             self.status_lbl.setText("Error")
             self.append_system_msg(f"初始化失败: {e}")
 
+    def init_governor(self):
+        # 🟢 不再每次请求前 gc.collect()：超预算且空闲 (没在生成、没在播放) 时才回收
+        self.governor = MemoryGovernor(rss_budget_mb=settings.MEMORY_BUDGET_MB, trace=settings.MEMORY_TRACE)
+        # KV 缓存在加载时按 n_ctx 一次分配好，reset() 不会还内存，所以推理进程只计入 RSS、不注册收缩
+        self.governor.register("llm", pid=lambda: self.llm.pid)
+        self.governor.register(
+            "tts", busy=lambda: not self.tts.audio_mgr.q.empty(),
+            probe=lambda: {"audio_queue": self.tts.audio_mgr.q.qsize(), "speak_queue": self.tts._speak_q.qsize()})
+        self.governor.register("brain", probe=self.brain.memory_footprint, shrink=self.brain.shrink_history)
+        self.governor.register(
+            "chat_view", shrink=self.mem_shrink.emit,
+            probe=lambda: {"rows": len(self.chat_model.rows), "layout_cache": len(self.chat_delegate.cache)})
+        self.mem_shrink.connect(self.on_mem_shrink)
+        self.governor.start()
+
+    def on_mem_shrink(self):
+        self.chat_delegate.cache.clear()
+        if self._at_bottom(): self.chat_delegate.forget(self.chat_model.trim())
+
+    def memory_summary(self):
+        rss = self.governor.snapshot()["rss"]
+        return " / ".join(f"{k}: {v / 1048576:.0f}MB" for k, v in rss.items() if v)
+
     def on_vol_change(self, v): 
         if hasattr(self, 'tts'): self.tts.set_volume(v/100.0)
 
@@ -289,6 +542,7 @@ class MainWindow(QWidget):
         t = self.input.text().strip()
         if not t: return
         self.lock_ui(True)
+        if hasattr(self, 'governor'): self.governor.mark_busy()
         self.avatar.set_state("THINK")
         self.input.clear()
         self.append_user_msg(t)
@@ -300,52 +554,83 @@ class MainWindow(QWidget):
         worker.signals.new_sentence.connect(self.on_sentence)
         worker.signals.finished.connect(self.on_finish)
         worker.signals.status_update.connect(self.update_status)
+        worker.signals.think_started.connect(self.on_think)
         self.threadpool.start(worker)
 
+    def on_think(self):
+        self.chat_model.insert_status("Thinking Process Hidden...")
+        self.chat_delegate.forget(self.chat_model.trim())
+
     def on_token(self, t):
         self.current_ai_msg += t
-        c = self.chat.textCursor(); c.movePosition(QTextCursor.End); c.insertText(t); self.chat.ensureCursorVisible()
+        follow = self._at_bottom()
+        index = self.chat_model.append_token(t)
+        if index is not None: self.chat_delegate.watch_stream(index)
+        if follow: self.chat.scrollToBottom()
 
     def on_sentence(self, s):
         self.avatar.set_state("SPEAK")
-        import threading
-        threading.Thread(target=self.tts.speak, args=(s,)).start()
+        # 🟢 交给 TTS 的单一后台线程：按顺序播放，积压的短句会被合并合成
+        self.tts.enqueue(s)
 
     def on_finish(self):
+        self.chat_model.finish_last()
+        if hasattr(self, 'governor'):
+            self.governor.mark_idle()
+            self.status_lbl.setToolTip(self.memory_summary())
         self.lock_ui(False); self.avatar.set_state("IDLE"); self.status_lbl.setText("Online")
 
     def do_recall(self):
         if not hasattr(self, 'brain'): return
         self.append_system_msg("提取记忆碎片...")
-        summary = ""
+        lines = []
         for m in self.brain.history[-4:]:
             role = "我" if m['role']=='user' else "AI"
-            summary += f"<br><span style='color:#bbb'><b>{role}:</b> {m['content'][:15]}...</span>"
-        self.chat.append(f"<div style='background:rgba(0,0,0,0.1); padding:8px; border-radius:5px; font-size:12px;'>{summary}</div>")
+            lines.append(f"{role}: {m['content'][:15]}...")
+        if lines: self._append_row("system", "\n".join(lines))
 
     def do_stop(self):
         if hasattr(self, 'tts'): self.tts.stop()
 
     def do_clear(self):
         if hasattr(self, 'brain'): self.brain.clear_memory()
-        self.chat.clear(); self.append_system_msg("记忆已重置")
+        self.chat_model.clear(); self.chat_delegate.cache.clear(); self.append_system_msg("记忆已重置")
 
     def lock_ui(self, lock):
         self.is_thinking = lock; self.input.setDisabled(lock); self.send_btn.setDisabled(lock)
 
+    def _at_bottom(self):
+        bar = self.chat.verticalScrollBar()
+        return bar.value() >= bar.maximum() - 4
+
+    def _append_row(self, role, text, done=True, persist=False):
+        self.chat_model.append_message(role, text, done=done, persist=persist)
+        # 新消息总是滚到底部，顺便把顶部超出上限的旧消息丢掉
+        self.chat_delegate.forget(self.chat_model.trim())
+        self.chat.scrollToBottom()
+
+    def on_chat_scroll(self, value):
+        bar = self.chat.verticalScrollBar()
+        if value == bar.minimum() and self.chat_model.can_load_older():
+            # 滚到顶：从硬盘再翻一页，并保持当前看到的那条消息不动
+            added = self.chat_model.load_older()
+            if added: self.chat.scrollTo(self.chat_model.index(added, 0), QAbstractItemView.PositionAtTop)
+        elif value >= bar.maximum() - 4 and len(self.chat_model.rows) > ChatListModel.MAX_ROWS:
+            # 回到底部：翻页加载的旧消息可以释放了
+            self.chat_delegate.forget(self.chat_model.trim())
+            self.chat.scrollToBottom()
+
     def append_user_msg(self, text):
-        html = f"""<div style="width:100%; display:flex; justify-content:flex-end;"><div style="background-color:#007acc; color:white; padding:8px 12px; border-radius:15px 15px 2px 15px; font-size:14px; max-width:75%; margin:4px;">{text}</div></div>"""
-        self.chat.append(html); self.chat.moveCursor(QTextCursor.End); self.chat.setAlignment(Qt.AlignRight) 
+        self._append_row("user", text, persist=True)
 
     def append_ai_msg_start(self):
-        html = f"""<div style="width:100%; display:flex; justify-content:flex-start;"><div style="background-color:rgba(255,255,255,0.1); color:#eee; padding:8px 12px; border-radius:15px 15px 15px 2px; font-size:14px; max-width:85%; margin:4px;">"""
-        self.chat.append(html); self.chat.setAlignment(Qt.AlignLeft)
+        self._append_row("assistant", "", done=False)
 
     def append_system_msg(self, text):
-        html = f"<div style='text-align:center; color:#888; font-size:11px; margin:8px;'>— {text} —</div>"
-        self.chat.append(html); self.chat.setAlignment(Qt.AlignCenter)
+        self._append_row("system", text)
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # PyInstaller 打包后子进程需要它
     app = QApplication(sys.argv)
     app.setStyleSheet(ModernStyles.QSS)
     win = MainWindow()
@@ -0,0 +1,280 @@
+import os, time, queue, wave, argparse, threading, multiprocessing
+import numpy as np
+
+from services.sherpa_asr_service import SherpaASRService
+from services.sherpa_service import SherpaTTSService
+from services.llm_process_service import LLMProcessService
+from core.cai_brain import CAIBrain
+from core.speech_chunker import SentenceChunker
+from core.memory_governor import MemoryGovernor
+from config import settings
+
+# =========================================================================
+# 🎙️ 无头语音对话：ASR → 大脑 → TTS 三级流水线 (不依赖 Qt，适合 kiosk/守护进程)
+# =========================================================================
+# 每一级一个线程，级间用有界队列连接：下游慢了上游自然会被卡住 (背压)。
+# 上一句还在合成/播放时，ASR 已经在听下一句，LLM 的 token 边出边断句边合成。
+
+_END = object()  # 一轮回复结束的标记
+
+class StageTimer:
+    """记录每轮对话在各个阶段的时间点，最后汇总平均耗时"""
+
+    def __init__(self, max_turns=500):
+        self.lock = threading.Lock()
+        self.turns = {}
+        self.durations = {}  # 不是时间点、而是累计耗时的指标 (如 ASR 解码时间)
+        self.max_turns = max_turns  # 守护进程长期运行，只保留最近的记录
+
+    def mark(self, turn, stage, at=None):
+        with self.lock:
+            self.turns.setdefault(turn, {}).setdefault(stage, at if at is not None else time.perf_counter())
+            if len(self.turns) > self.max_turns:
+                self.turns.pop(min(self.turns))
+
+    def record(self, turn, name, seconds):
+        with self.lock:
+            self.durations.setdefault(turn, {})[name] = seconds
+            if len(self.durations) > self.max_turns:
+                self.durations.pop(min(self.durations))
+
+    def summary(self):
+        spans = {
+            "asr_utterance": ("speech_start", "asr_done"),
+            "llm_first_token": ("asr_done", "first_token"),
+            "first_sentence": ("first_token", "first_sentence"),
+            "tts_first_audio": ("first_sentence", "first_audio"),
+            "response_latency": ("asr_done", "first_audio"),
+            "reply_total": ("asr_done", "reply_done"),
+        }
+        result = {}
+        with self.lock:
+            for name, (a, b) in spans.items():
+                values = [t[b] - t[a] for t in self.turns.values() if a in t and b in t]
+                if values: result[name] = sum(values) / len(values)
+            for name in {n for d in self.durations.values() for n in d}:
+                values = [d[name] for d in self.durations.values() if name in d]
+                result[name] = sum(values) / len(values)
+        return result
+
+class VoiceLoop:
+    def __init__(self, asr, brain, tts, queue_size=4, out_dir=None, speculative=False, governor=None,
+                 barge_in=False, echo_tail=0.5):
+        """
+        :param barge_in: 允许在回复播放期间说话。外放时麦克风会录到自己的声音，只有戴耳机才应该打开
+        :param echo_tail: 播放结束后这么多秒内开始的话仍按回声处理 (声卡缓冲 + 房间混响)
+        """
+        self.asr = asr
+        self.brain = brain
+        self.tts = tts
+        self.out_dir = out_dir
+        self.speculative = speculative
+        self.timer = StageTimer()
+        self.governor = governor
+        self.barge_in = barge_in
+        self.echo_tail = echo_tail
+        self._play_start = None  # 当前这段回复开始播放的时间，没在播放时为 None
+        self._play_end = 0.0     # 上一段回复播放结束的时间
+
+        # 🟢 有界队列 = 背压
+        self.text_q = queue.Queue(maxsize=2)
+        self.sentence_q = queue.Queue(maxsize=queue_size)
+        self.audio_q = queue.Queue(maxsize=queue_size)
+        self.stopped = threading.Event()
+
+    # ---------------- 第 1 级：ASR ----------------
+    def _asr_stage(self, wav_files):
+        turn = 0
+        index = 0  # 下一个要识别的 wav 文件
+        try:
+            while not self.stopped.is_set():
+                if wav_files is not None:
+                    if index >= len(wav_files): break
+                    text = self.asr.listen_file(wav_files[index])
+                    index += 1
+                    if not text.strip():
+                        print(f"\n[👂] {wav_files[index - 1]} 没有识别出内容，跳过"); continue
+                else:
+                    on_partial = self._speculate if self.speculative else None
+                    text = self.asr.listen(on_partial=on_partial)
+                    if not text.strip(): continue
+                    if not self.barge_in and self._heard_playback(self.asr.last_timing["speech_start"]):
+                        print(f"\n[👂] 播放期间录到的声音 (多半是自己的回声)，丢弃: {text}"); continue
+                timing = getattr(self.asr, "last_timing", None)
+                if timing:
+                    if timing["speech_start"] is not None: self.timer.mark(turn, "speech_start", at=timing["speech_start"])
+                    self.timer.record(turn, "asr_decode", timing["decode_sec"])
+                self.timer.mark(turn, "asr_done")
+                print(f"\n[👂 {turn}] {text}")
+                self.text_q.put((turn, text))
+                turn += 1
+        finally:
+            self.text_q.put(None)
+
+    def _heard_playback(self, since):
+        """since 之后是否有回复在扬声器里播放 (麦克风可能把它录了进去)"""
+        if self.out_dir: return False  # 落盘模式不出声
+        if self._play_start is not None: return True
+        return since is None or since < self._play_end + self.echo_tail
+
+    def _speculate(self, partial_text):
+        # 播放期间的中间结果可能是回声，不拿去预填充
+        if not self.barge_in and self._play_start is not None: return
+        self.brain.speculate(partial_text)
+
+    # ---------------- 第 2 级：大脑 + 断句 ----------------
+    def _brain_stage(self):
+        while True:
+            item = self.text_q.get()
+            if item is None: break
+            turn, text = item
+            chunker = SentenceChunker()
+            if self.governor: self.governor.mark_busy()
+            try:
+                for token in self.brain.chat_stream(text):
+                    self.timer.mark(turn, "first_token")
+                    for sent in chunker.feed(token):
+                        self.timer.mark(turn, "first_sentence")
+                        self.sentence_q.put((turn, sent))
+            finally:
+                if self.governor: self.governor.mark_idle()
+            for sent in chunker.flush():
+                self.timer.mark(turn, "first_sentence")
+                self.sentence_q.put((turn, sent))
+            self.sentence_q.put((turn, _END))
+        self.sentence_q.put(None)
+
+    # ---------------- 第 3 级：TTS 合成 ----------------
+    def _tts_stage(self):
+        started = set()  # 已经出过声的轮次
+        held = []  # 打包时多取出来、属于下一轮 (或结束标记) 的那一项
+        while True:
+            item = held.pop() if held else self.sentence_q.get()
+            if item is None: break
+            turn, sent = item
+            if sent is _END:
+                started.discard(turn)
+                self.audio_q.put((turn, _END)); continue
+
+            # 🟢 合成忙的时候句子会积压：把同一轮里已经排队的短句一起取出来打包合成
+            batch = [sent]
+            while sum(len(x) for x in batch) < self.tts.packer.target_len:
+                try: nxt = self.sentence_q.get_nowait()
+                except queue.Empty: break
+                if nxt is None or nxt[0] != turn or nxt[1] is _END:
+                    held.append(nxt); break
+                batch.append(nxt[1])
+
+            for group in self.tts.packer.pack(batch, first_alone=turn not in started):
+                print(f"[🗣️ {turn}] {''.join(group).strip()}")
+                for audio in self.tts.synthesize_batch(group):
+                    if len(audio) == 0: continue
+                    started.add(turn)
+                    self.timer.mark(turn, "first_audio")
+                    self.audio_q.put((turn, audio))
+        self.audio_q.put(None)
+
+    # ---------------- 第 4 级：播放 / 落盘 ----------------
+    def _output_stage(self):
+        pending = {}
+        while True:
+            item = self.audio_q.get()
+            if item is None: break
+            turn, audio = item
+            if audio is not _END:
+                if self.out_dir: pending.setdefault(turn, []).append(audio)
+                else:
+                    if self._play_start is None: self._play_start = time.perf_counter()
+                    self.tts.audio_mgr.play_chunk(audio)
+                continue
+            if self.out_dir:
+                self._write_wav(turn, pending.pop(turn, []))
+            else:
+                self.tts.audio_mgr.wait()
+                if self._play_start is not None:
+                    self._play_start = None
+                    self._play_end = time.perf_counter()
+            self.timer.mark(turn, "reply_done")
+
+    def _write_wav(self, turn, chunks):
+        if not chunks: return
+        audio = np.clip(np.concatenate(chunks), -1.0, 1.0)
+        path = os.path.join(self.out_dir, f"reply_{turn:03d}.wav")
+        with wave.open(path, "wb") as f:
+            f.setnchannels(1); f.setsampwidth(2)
+            f.setframerate(self.tts.tts.sample_rate)
+            f.writeframes((audio * 32767).astype(np.int16).tobytes())
+        print(f"[💾 {turn}] {path}")
+
+    def run(self, wav_files=None):
+        if self.out_dir: os.makedirs(self.out_dir, exist_ok=True)
+        stages = [
+            threading.Thread(target=self._asr_stage, args=(wav_files,), name="ASR", daemon=True),
+            threading.Thread(target=self._brain_stage, name="Brain", daemon=True),
+            threading.Thread(target=self._tts_stage, name="TTS", daemon=True),
+            threading.Thread(target=self._output_stage, name="Output", daemon=True),
+        ]
+        for t in stages: t.start()
+        try:
+            # 用带超时的 join，Ctrl+C 才能打断
+            while stages[-1].is_alive(): stages[-1].join(0.5)
+        except KeyboardInterrupt:
+            print("\n[Voice] 退出中...")
+            self.stopped.set()
+            self.tts.stop()
+        return self.timer.summary()
+
+def main():
+    parser = argparse.ArgumentParser(description="CAI 无头语音对话 (ASR → Brain → TTS)")
+    parser.add_argument("--wav", nargs="+", help="按顺序识别这些 16-bit wav 文件，不传则使用麦克风")
+    parser.add_argument("--out-dir", help="把回复写成 wav 文件而不是直接播放")
+    parser.add_argument("--queue-size", type=int, default=4, help="句子/音频队列长度 (背压)")
+    parser.add_argument("--speculative", action="store_true", help="用 ASR 中间结果做投机预填充")
+    parser.add_argument("--barge-in", action="store_true",
+                        help="播放回复时也接受说话 (需要戴耳机，外放会把自己的声音识别进去)")
+    parser.add_argument("--small-model", help="models/ 下的小模型文件名，开启级联路由 (如 model-small.gguf)")
+    parser.add_argument("--mem-budget", type=int, default=settings.MEMORY_BUDGET_MB, help="内存预算 (MB)")
+    parser.add_argument("--mem-trace", action="store_true", default=settings.MEMORY_TRACE,
+                        help="用 tracemalloc 统计 Python 堆，结束时打印分配最多的代码行")
+    args = parser.parse_args()
+
+    asr = SherpaASRService()
+    llm = LLMProcessService(speculative_prefill=args.speculative)
+    small = None
+    if args.small_model:
+        small = lambda: LLMProcessService(model_file=args.small_model, speculative_prefill=args.speculative)
+    brain = CAIBrain(llm, small_llm_service=small)
+    tts = SherpaTTSService()
+
+    governor = MemoryGovernor(rss_budget_mb=args.mem_budget, trace=args.mem_trace)
+    governor.register("llm", pid=lambda: llm.pid)  # 只计入 RSS：KV 缓存按 n_ctx 预分配，清空也不还内存
+    governor.register("brain", probe=brain.memory_footprint, shrink=brain.shrink_history)
+
+    loop = VoiceLoop(asr, brain, tts, queue_size=args.queue_size,
+                     out_dir=args.out_dir, speculative=args.speculative, governor=governor,
+                     barge_in=args.barge_in)
+    governor.register(
+        "pipeline", busy=lambda: not tts.audio_mgr.q.empty() or not loop.audio_q.empty(),
+        probe=lambda: {"text_q": loop.text_q.qsize(), "sentence_q": loop.sentence_q.qsize(),
+                       "audio_q": loop.audio_q.qsize(), "playback_q": tts.audio_mgr.q.qsize()})
+    governor.start()
+    summary = loop.run(args.wav)
+
+    print("\n[Voice] 各阶段平均耗时:")
+    for name, seconds in summary.items():
+        print(f"  {name:<18} {seconds * 1000:8.1f} ms")
+    print(f"[Voice] TTS 实时率: {tts.get_rtf():.3f} ({tts.rtf_stats['segments']} 句 / {tts.rtf_stats['calls']} 次合成)")
+    if args.speculative:
+        print(f"[Voice] 预填充统计: {llm.get_prefill_stats()}")
+    if brain.router:
+        print(f"[Voice] 路由统计: {brain.get_routing_stats()}")
+    print(f"[Voice] 内存: {governor.snapshot()}")
+    if args.mem_trace:
+        for where, size, count in governor.top_allocations(5):
+            print(f"  {size / 1024:8.1f} KB {count:6d} 块  {where}")
+    governor.stop()
+    llm.close()
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    main()